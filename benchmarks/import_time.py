@@ -0,0 +1,82 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ Measures the time taken to import flair (or one of its modules) using `python -X importtime`, so that regressions
+ in import time can be caught. Run as `python benchmarks/import_time.py [module] [--max-ms N] [--json]`. The exit
+ status is non-zero if the median import time exceeds --max-ms.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str) -> List[Tuple[str, int, int]]:
+    """Import `module` in a fresh interpreter and return the name, cumulative import time in microseconds and nesting
+    depth of `module` and every module imported as a result of it, in the order they finished importing."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=REPO_ROOT, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                            universal_newlines=True, check=True)
+    timings = []
+    for line in result.stderr.splitlines():  # format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2  # nested imports are indented by two spaces per level
+        timings.append((name.strip(), int(cumulative), depth))
+
+    # modules imported on interpreter startup come first; keep only the target and the imports nested under it
+    end = max(i for i, (name, _, _) in enumerate(timings) if name == module)
+    start = end
+    while start > 0 and timings[start - 1][2] > timings[end][2]:
+        start -= 1
+    return timings[start:end + 1]
+
+
+def summarise(module: str, runs: int) -> Dict:
+    """Import `module` `runs` times and summarise the results."""
+    totals = []
+    last = []
+    for _ in range(runs):
+        last = measure(module)
+        totals.append(last[-1][1])
+    depth = last[-1][2]
+    direct = sorted(((n, t) for n, t, d in last if d == depth + 1), key=lambda i: i[1], reverse=True)
+    return {
+        'module': module,
+        'runs': runs,
+        'median_ms': statistics.median(totals) / 1000,
+        'min_ms': min(totals) / 1000,
+        'modules_imported': len(last),
+        'slowest_imports_ms': {n: t / 1000 for n, t in direct[:10]},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-3])
+    parser.add_argument('module', nargs='?', default='flair', help='Module to import (default: flair)')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters to measure')
+    parser.add_argument('--max-ms', type=float, help='Fail if the median import time exceeds this')
+    parser.add_argument('--json', action='store_true', help='Output results as JSON')
+    arguments = parser.parse_args()
+
+    summary = summarise(arguments.module, arguments.runs)
+    if arguments.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"import {summary['module']}: median {summary['median_ms']:.2f} ms, min {summary['min_ms']:.2f} ms "
+              f"over {summary['runs']} runs; {summary['modules_imported']} modules imported")
+        for name, ms in summary['slowest_imports_ms'].items():
+            print(f'  {name:30} {ms:8.2f} ms')
+
+    if arguments.max_ms is not None and summary['median_ms'] > arguments.max_ms:
+        sys.exit(f"Import time regression: {summary['median_ms']:.2f} ms > {arguments.max_ms} ms")
@@ -0,0 +1,220 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ Measures the throughput of the memory-read and poll path against a stand-in for the game's process (target.py):
+ reads per second for each field type, the cost of decoding, the latency of a full poll tick and its allocations.
+ Run as `sudo python benchmarks/memory_read.py [--duration S] [--json] [--compare previous.json]`. Linux only.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from flair.hook import process  # noqa: E402
+
+TICK_GETTERS = (process.get_name, process.get_credits, process.get_position, process.get_mouseover,
+                process.get_chat_box_state, process.get_character_loaded, process.get_docked)
+
+
+def start_target() -> subprocess.Popen:
+    """Start the stand-in process and wait until its memory is ready to be read."""
+    target = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'benchmarks', 'target.py')],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    if target.stdout.readline().strip() != 'ready':
+        raise RuntimeError('Stand-in process failed to start')
+    return target
+
+
+def rate(function: Callable[[], object], duration: float) -> float:
+    """Call `function` repeatedly for about `duration` seconds and return the number of calls per second."""
+    calls = 0
+    batch = 100
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            function()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return calls / elapsed
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarise latencies (in seconds) as percentiles in microseconds."""
+    samples = sorted(samples)
+
+    def at(p: float) -> float:
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6
+
+    return {'p50_us': at(0.5), 'p90_us': at(0.9), 'p99_us': at(0.99), 'max_us': samples[-1] * 1e6,
+            'mean_us': statistics.mean(samples) * 1e6}
+
+
+def poll_tick(pid: int):
+    """Do the work of one poll: read every address in one batch, then compute each polled value from the snapshot."""
+    snapshot = process.read_snapshot(pid)
+    for getter in TICK_GETTERS:
+        getter(snapshot)
+
+
+def bench_reads(pid: int, duration: float) -> Dict[str, Dict[str, float]]:
+    """Measure reads per second of each type of field, both individually and as a batched snapshot."""
+    by_type: Dict[str, List[str]] = {}
+    for key, (_, datatype) in process.READ_ADDRESSES.items():
+        by_type.setdefault(datatype.__name__, []).append(key)
+
+    results = {}
+    for type_name, keys in sorted(by_type.items()):
+        key = keys[0]
+        if type_name == 'str':
+            single = lambda: process.get_string(pid, key, process.STRING_LENGTHS[key])  # noqa: E731
+        else:
+            single = lambda: process.get_value(pid, key)  # noqa: E731
+        results[type_name] = {
+            'single_reads_per_s': rate(single, duration),
+            'batch_reads_per_s': rate(lambda: process.read_snapshot(pid, keys), duration),
+            'fields_per_batch': len(keys),
+        }
+    return results
+
+
+def bench_decode(pid: int, duration: float) -> Dict[str, float]:
+    """Measure the cost of decoding each type of raw value, in nanoseconds."""
+    results = {}
+    keys = {}
+    for key, (_, datatype) in process.READ_ADDRESSES.items():
+        keys.setdefault(datatype, key)
+    for datatype, key in keys.items():
+        raw = process.read_raw(pid, (key,))[key]
+        results[f'{datatype.__name__}_ns'] = 1e9 / rate(lambda: process._decode(datatype, raw, len(raw)), duration)
+    return results
+
+
+def bench_tick(pid: int, ticks: int) -> Dict[str, float]:
+    """Measure the latency of a full poll tick, and how much memory it allocates."""
+    for _ in range(100):  # warm up caches
+        poll_tick(pid)
+
+    latencies = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        poll_tick(pid)
+        latencies.append(time.perf_counter() - start)
+    results = percentiles(latencies)
+
+    blocks = sys.getallocatedblocks()
+    for _ in range(ticks):
+        poll_tick(pid)
+    results['blocks_retained_per_tick'] = (sys.getallocatedblocks() - blocks) / ticks
+
+    if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+        peaks = []
+        tracemalloc.start()
+        for _ in range(min(ticks, 1000)):  # tracing is slow
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            poll_tick(pid)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        results['peak_bytes_allocated_per_tick'] = statistics.median(peaks)
+    return results
+
+
+def bench_state_variables(pid: int, duration: float) -> Dict[str, float]:
+    """Measure the overhead of reading and updating values through `state_variable` descriptors, using a minimal
+    owner in place of `FreelancerState` (which needs a window and a Freelancer installation)."""
+    from flair.inspect.state import state_variable
+
+    class Owner:
+        def __init__(self):
+            self.pid = pid
+            self._values = {}
+            self._snapshot = process.read_snapshot(pid)
+
+        def _notify_watchers(self, variable, value):
+            pass
+
+        @state_variable(0)
+        def credits(self):
+            return process.get_credits(self._snapshot)
+
+    owner = Owner()
+
+    def refresh():
+        owner.credits = owner.credits
+
+    return {'gets_per_s': rate(lambda: owner.credits, duration), 'refreshes_per_s': rate(refresh, duration)}
+
+
+def run(duration: float, ticks: int) -> Dict:
+    """Run every benchmark against a fresh stand-in process."""
+    target = start_target()
+    try:
+        pid = target.pid
+        results = {
+            'python': sys.version.split()[0],
+            'reads': bench_reads(pid, duration),
+            'decode': bench_decode(pid, duration),
+            'tick': bench_tick(pid, ticks),
+        }
+        try:
+            results['state_variables'] = bench_state_variables(pid, duration)
+        except ImportError as e:  # the inspect package needs all of flair's dependencies
+            results['state_variables'] = {'skipped': str(e)}
+        return results
+    finally:
+        target.stdin.close()
+        target.wait()
+
+
+def flatten(results: Dict, prefix='') -> Dict[str, object]:
+    """Flatten nested results into a single dict with dotted keys, e.g. 'tick.p50_us'."""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(current: Dict, previous: Dict) -> List[str]:
+    """Return a line for each numeric result, showing its change relative to a previous run."""
+    current, previous = flatten(current), flatten(previous)
+    lines = []
+    for key, value in current.items():
+        old = previous.get(key)
+        if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            lines.append(f'{key:45} {old:14.2f} -> {value:14.2f} ({(value - old) / old * 100:+.1f}%)')
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-3])
+    parser.add_argument('--duration', type=float, default=0.5, help='Seconds to spend on each throughput measurement')
+    parser.add_argument('--ticks', type=int, default=5000, help='Number of poll ticks to measure latency over')
+    parser.add_argument('--json', action='store_true', help='Output results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='Compare results with those of a previous run (as JSON)')
+    arguments = parser.parse_args()
+
+    results = run(arguments.duration, arguments.ticks)
+    if arguments.json:
+        print(json.dumps(results, indent=2))
+    elif arguments.compare:
+        with open(arguments.compare) as f:
+            print('\n'.join(compare(results, json.load(f))))
+    else:
+        for name, value in flatten(results).items():
+            print(f'{name:45} {value:14.2f}' if isinstance(value, float) else f'{name:45} {value:>14}')
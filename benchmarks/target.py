@@ -0,0 +1,92 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ A stand-in for Freelancer's process, for benchmarking the memory-read path without the game. It maps memory at the
+ fixed addresses in `READ_ADDRESSES` and fills them with synthetic values, prints "ready" and then runs until its
+ standard input is closed. If --mutate is given, credits and position change that many times per second, so that the
+ change-handling path is exercised as well. Linux only.
+"""
+import argparse
+import ctypes
+import mmap
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flair.hook.process import READ_ADDRESSES, STRING_LENGTHS  # noqa: E402
+
+MAP_FIXED_NOREPLACE = 0x100000  # fail rather than replace an existing mapping
+
+SYNTHETIC_VALUES = {
+    'last_message': 'Hello, Liberty!',
+    'mouseover': 'Planet Manhattan',
+    'rollover': 'Trade Lane Ring 1/8',
+    'name': 'Trent',
+    'credits': 2000,
+    'pos_x': -30367.0,
+    'pos_y': 0.0,
+    'pos_z': -25810.0,
+    'enter_dialogue': 0,
+    'focus_dialogue': 0,
+    'logged_in': 1,
+    'singleplayer': 0,
+    'in_space': 1,
+}
+
+
+def map_addresses():
+    """Map the pages spanning every address in `READ_ADDRESSES`, at the same addresses as in the game."""
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+
+    start = min(a for a, _ in READ_ADDRESSES.values()) & ~(mmap.PAGESIZE - 1)
+    end = max(a + (STRING_LENGTHS.get(k, 0) + 1) * 2 + 8 for k, (a, _) in READ_ADDRESSES.items())
+    size = (end - start + mmap.PAGESIZE - 1) & ~(mmap.PAGESIZE - 1)
+    address = libc.mmap(start, size, mmap.PROT_READ | mmap.PROT_WRITE,
+                        mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS | MAP_FIXED_NOREPLACE, -1, 0)
+    if address != start:
+        raise OSError(ctypes.get_errno(), f'Could not map {size:#x} bytes at {start:#x}')
+
+
+def write(key: str, value):
+    """Write a value to the address named by `key`."""
+    address, datatype = READ_ADDRESSES[key]
+    if datatype is str:
+        encoded = value.encode('utf-16-le') + b'\0\0'
+        ctypes.memmove(address, encoded, len(encoded))
+    else:
+        datatype.from_address(address).value = value
+
+
+def mutate(rate: float):
+    """Change credits and position `rate` times per second."""
+    credits = SYNTHETIC_VALUES['credits']
+    while True:
+        credits += 1
+        write('credits', credits)
+        write('pos_x', SYNTHETIC_VALUES['pos_x'] + credits % 1000)
+        time.sleep(1 / rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A stand-in for Freelancer\'s process, for benchmarking.')
+    parser.add_argument('--mutate', type=float, help='Change credits and position this many times per second')
+    arguments = parser.parse_args()
+
+    map_addresses()
+    for key, value in SYNTHETIC_VALUES.items():
+        if key in READ_ADDRESSES:
+            write(key, value)
+    if arguments.mutate:
+        threading.Thread(target=mutate, args=(arguments.mutate,), daemon=True).start()
+
+    print('ready', flush=True)
+    sys.stdin.read()  # run until the benchmark closes our standard input
@@ -4,18 +4,53 @@
  This Source Code Form is subject to the terms of the Mozilla Public
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ Submodules and the names below are imported upon first access (PEP 562), so that importing flair, or only part of
+ it, does not pull in heavy dependencies like keyboard, Xlib and flint until they are needed.
 """
+import importlib
+import sys
+
 __version__ = 0.4
 
-from . import hook, augment, inspect
-from .inspect import events
-from .inspect.state import FreelancerState
+SUBMODULES = {'hook', 'augment', 'inspect', 'platforms'}
+LAZY_ATTRIBUTES = {  # maps each lazily imported name to the module it is defined in
+    'events': '.inspect.events',
+    'FreelancerState': '.inspect.state',
+    'Supervisor': '.inspect.supervisor',
+    'StringSampler': '.inspect.sampler',
+}
 
-state: FreelancerState
+state: 'FreelancerState'
 
 
 def set_install_path(path: str):
     """Set the path to the Freelancer installation directory this hook should work with. Accessing `state` before
     this is executed will cause an `AttributeError`."""
     global state
+    from .inspect.state import FreelancerState
     state = FreelancerState(path)
+
+
+def __getattr__(name: str):
+    """Import a submodule or attribute upon first access."""
+    if name in SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    if name in LAZY_ATTRIBUTES:
+        module = importlib.import_module(LAZY_ATTRIBUTES[name], __name__)
+        value = module if name == module.__name__.rpartition('.')[2] else getattr(module, name)
+        globals()[name] = value  # so that __getattr__ is not called again
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | SUBMODULES | set(LAZY_ATTRIBUTES))
+
+
+if sys.version_info < (3, 7):  # module __getattr__ is not supported, so import everything up front
+    from . import hook, augment, inspect
+    from .inspect import events
+    from .inspect.state import FreelancerState
+    from .inspect.supervisor import Supervisor
+    from .inspect.sampler import StringSampler
@@ -45,4 +45,5 @@ if __name__ == '__main__':
 
     game_state = FreelancerState(arguments.freelancer_dir)
     game_state.begin_polling(print_state=True)
-    augmentations = augment.Augmentation.load_all(game_state)
+    augmentations = augment.Augmentation.load_all(
+        game_state, on_load=lambda name, seconds: print_event(f'Augmentation loaded: {name} ({seconds * 1000:.0f} ms)'))
@@ -6,14 +6,16 @@
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Callable, TYPE_CHECKING
 
-from ..inspect.state import FreelancerState
+if TYPE_CHECKING:  # state is slow to import, so is only imported for type checkers
+    from ..inspect.state import FreelancerState
+    from .manager import AugmentationManager
 
 
 class Augmentation(ABC):
     """The base (abstract) class for a game client augmentation."""
-    def __init__(self, state: FreelancerState):
+    def __init__(self, state: 'FreelancerState'):
         self._state = state
 
     @abstractmethod
@@ -28,12 +30,19 @@ class Augmentation(ABC):
         pass
 
     @classmethod
-    def load_all(cls, state: FreelancerState) -> List['Augmentation']:
-        """Instantiate and load all subclasses of this class. Returns a list containing references to these instances.
-        Keep a reference to this to avoid them being garbage collected."""
-        # ensure built-in augmentations are interpreted
-        from . import cli, clipboard, screenshot
-        instances = [s(state) for s in cls.__subclasses__()]
-        for a in instances:
-            a.load()
-        return instances
+    def load_all(cls, state: 'FreelancerState', on_load: Callable[[str, float], None] = None) -> 'AugmentationManager':
+        """Load the built-in augmentations, those provided by installed packages and any other subclasses of this class
+        already defined. Augmentations with triggers are only loaded once they are needed. Returns the manager holding
+        references to them; iterating over it yields those currently loaded. Keep a reference to this to avoid them
+        being garbage collected. `on_load` is passed to the manager; see `AugmentationManager`."""
+        from .manager import AugmentationManager, AugmentationSpec, BUILTIN, discover
+        specs = {**BUILTIN, **discover()}
+        targets = {s.target for s in specs.values()}
+        for subclass in cls.__subclasses__():
+            target = f'{subclass.__module__}:{subclass.__qualname__}'
+            isolation_wrapper = subclass.__module__ == f'{__name__}.isolation'  # runs other augmentations
+            if target not in targets and not isolation_wrapper:
+                specs[subclass.__name__.lower()] = AugmentationSpec(target)
+        manager = AugmentationManager(state, specs, on_load)
+        manager.start()
+        return manager
@@ -1,24 +1,107 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 import datetime
+import os
+import subprocess
+import sys
+import threading
+import traceback
+from typing import Dict, List, Optional
 
 import flint
+import keyboard
 from ..inspect.state import FreelancerState
 
 from . import Augmentation
-from ..inspect.events import message_sent, character_changed
+from ..inspect.events import message_sent, character_changed, chat_box_opened
 from ..hook import input
 from .. import __version__
 
+# run in a separate interpreter to evaluate the expression given on standard input
+EVALUATOR = '''
+import sys
+try:
+    print(f'=> {eval(sys.stdin.read())}')
+except Exception as e:
+    print(f'Err: {e}')
+'''
+
+
+class CommandTrie:
+    """A prefix tree of command names, built once, which finds the command named by any unambiguous prefix of its
+    name and lists the names a prefix could be completed to."""
+
+    class Node:
+        __slots__ = ('children', 'command', 'names')
+
+        def __init__(self):
+            self.children: Dict[str, 'CommandTrie.Node'] = {}
+            self.command: Optional[type] = None  # the command named by the path to this node, if any
+            self.names: List[str] = []  # the names of every command below this node
+
+    def __init__(self, commands: Dict[str, type] = None):
+        self.root = self.Node()
+        for name, command in (commands or {}).items():
+            self.insert(name, command)
+
+    def insert(self, name: str, command: type):
+        node = self.root
+        node.names.append(name)
+        for character in name:
+            node = node.children.setdefault(character, self.Node())
+            node.names.append(name)
+        node.command = command
+
+    def _find(self, prefix: str) -> Optional['CommandTrie.Node']:
+        node = self.root
+        for character in prefix:
+            node = node.children.get(character)
+            if node is None:
+                return None
+        return node
+
+    def lookup(self, prefix: str) -> Optional[type]:
+        """Return the command named `prefix`, or else the only command whose name begins with it, if there is one."""
+        node = self._find(prefix)
+        while node is not None and node.command is None and len(node.names) == 1:
+            node, = node.children.values()  # follow the only branch to the command
+        return node.command if node is not None else None
+
+    def complete(self, prefix: str) -> List[str]:
+        """Return the names of every command beginning with `prefix`."""
+        node = self._find(prefix)
+        return sorted(node.names) if node is not None else []
+
+
+def evaluate(expression: str, timeout: float) -> str:
+    """Evaluate a Python expression in a separate process, which is killed if it runs for longer than `timeout`
+    seconds. Returns the result, or the error, formatted for display."""
+    try:
+        result = subprocess.run([sys.executable, '-I', '-c', EVALUATOR], input=expression, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return 'Err: evaluation timed out'
+    return result.stdout.strip() or 'Err: evaluation failed'
+
 
 class CLI(Augmentation):
-    """Adds a basic command-line interface."""
+    """Adds a basic command-line interface.
+
+    Commands can be invoked by any unambiguous prefix of their name, and a partially typed command name is completed
+    by pressing `COMPLETION_HOTKEY`. Commands run on a pool of worker threads, so a slow command can't hold up input."""
     INVOCATION = '..'
+    COMPLETION_HOTKEY = 'tab'
+    workers = 2  # the number of commands which can run at once
 
     class Command:
         """A command available in the in-game shell"""
         state: FreelancerState
+        # the time (in seconds) after which the command is cancelled. A running command cannot be stopped, but
+        # `cancelled` is set so it can stop itself. If None, the command is responsible for its own timeout
+        timeout: Optional[float] = 5.0
 
         def __init__(self, state):
             self.state = state
+            self.cancelled = threading.Event()
 
         def __call__(self, *args, **kwargs):
             pass
@@ -36,19 +119,18 @@ class CLI(Augmentation):
             if not self.state.system:
                 input.queue_display_text(f'Err: unknown location')
             else:
-                systems = {s.name(): s for s in flint.get_systems()}
-                system_scale = systems[self.state.system].navmapscale
+                system_scale = self.state.universe.navmap_scale(self.state.system)
                 sector = flint.maps.pos_to_sector(self.state.pos, system_scale)
                 input.queue_display_text(f'You are in sector {sector}, {self.state.system}')
 
     class Eval(Command):
         """Evaluate the given expression with Python"""
+        timeout = None  # the expression is evaluated in a separate process, which is killed after EVAL_TIMEOUT
+        EVAL_TIMEOUT = 2.0
+
         def __call__(self, *expression):
             if expression:
-                try:
-                    input.queue_display_text(f"=> {eval(' '.join(expression))}")
-                except Exception as e:
-                    input.queue_display_text(f"Err: {e}")
+                input.queue_display_text(evaluate(' '.join(expression), self.EVAL_TIMEOUT))
 
     class Quit(Command):
         """Quit the game"""
@@ -64,12 +146,41 @@ class CLI(Augmentation):
                 input.queue_display_text(f'{CLI.INVOCATION}{c.__name__}: {c.__doc__}'.lower())
 
     def load(self):
+        self.commands = CommandTrie({c.__name__.lower(): c for c in self.Command.__subclasses__()})
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='flair command')
+        self._completion = None  # removes the completion hotkey, while it is hooked
         character_changed.connect(self.show_welcome_message)
         message_sent.connect(self.parse_message)
+        chat_box_opened.connect(self.hook_completion)
 
     def unload(self):
         character_changed.disconnect(self.show_welcome_message)
         message_sent.disconnect(self.parse_message)
+        chat_box_opened.disconnect(self.hook_completion)
+        self.unhook_completion()
+        self._pool.shutdown(wait=False)
+
+    def hook_completion(self):
+        self._completion = keyboard.add_hotkey(self.COMPLETION_HOTKEY, self.complete_command)
+
+    def unhook_completion(self):
+        """Remove the completion hotkey if it is still hooked, i.e. the chat box is open."""
+        if self._completion is not None:
+            try:
+                keyboard.remove_hotkey(self._completion)
+            except KeyError:
+                pass  # already removed along with every other hotkey when the chat box closed
+            self._completion = None
+
+    def complete_command(self):
+        """Complete the command name being typed in the chat box as far as is unambiguous."""
+        text = input.get_chat_box_contents()
+        preamble, invocation, partial = text.partition(self.INVOCATION)
+        if not invocation or preamble or ' ' in partial or input.chat_box.cursor != len(text):
+            return
+        completion = os.path.commonprefix(self.commands.complete(partial.lower()))[len(partial):]
+        if completion:
+            input.inject_text(completion)
 
     @staticmethod
     def show_welcome_message(name: str):
@@ -80,10 +191,39 @@ class CLI(Augmentation):
     def parse_message(self, message: str):
         """Parse and interpret a message."""
         preamble, invocation, command = message.strip().partition(self.INVOCATION)
-        if invocation and not preamble:
-            command_name, *args = [t for t in command.split()]
-            commands = {c.__name__.lower(): c for c in self.Command.__subclasses__()}
-            if command_name in commands:
-                commands[command_name](self._state)(*args)
+        if invocation and not preamble and command.strip():
+            command_name, *args = command.split()
+            found = self.commands.lookup(command_name.lower())
+            if found:
+                self.run(found(self._state), args)
+            elif self.commands.complete(command_name.lower()):
+                matches = ', '.join(self.commands.complete(command_name.lower()))
+                input.queue_display_text(f'Err: ambiguous command, could be any of {matches}')
             else:
                 input.queue_display_text('Err: command not found')
+
+    def run(self, command: 'CLI.Command', args: List[str]) -> Future:
+        """Run a command on the worker pool, cancelling it if it exceeds its timeout."""
+        future = self._pool.submit(command, *args)
+        future.add_done_callback(self._report_error)
+        if command.timeout is not None:
+            timer = threading.Timer(command.timeout, self._expire, (command, future))
+            timer.daemon = True
+            timer.start()
+            future.add_done_callback(lambda _: timer.cancel())
+        return future
+
+    @staticmethod
+    def _expire(command: 'CLI.Command', future: Future):
+        """Handle a command exceeding its timeout."""
+        command.cancelled.set()
+        if future.cancel() or not future.done():
+            input.queue_display_text(f'Err: {type(command).__name__.lower()} timed out')
+
+    @staticmethod
+    def _report_error(future: Future):
+        """Display the error raised by a command, if any."""
+        if not future.cancelled() and future.exception() is not None:
+            error = future.exception()
+            traceback.print_exception(type(error), error, error.__traceback__)
+            input.queue_display_text(f'Err: {error}')
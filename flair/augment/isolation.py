@@ -0,0 +1,338 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ Running augmentations in worker processes, so that a CPU-heavy augmentation can't hold the GIL of the process
+ running the poll loop and keyboard hooks.
+
+ The worker receives every event, which it re-emits through its own copy of `flair.events`, and a regular snapshot of
+ the game's state, which is exposed to the augmentation in place of a `FreelancerState`. Within the worker,
+ `flair.hook.input` is replaced by a proxy which forwards calls to the real module in the main process, so that
+ augmentations can use it unchanged.
+"""
+import collections
+import importlib
+import itertools
+import multiprocessing
+import queue
+import sys
+import threading
+import traceback
+import types
+from typing import Any, Callable, Dict, Optional, TYPE_CHECKING
+
+from ..inspect import events
+from ..inspect.scheduler import scheduler
+from . import Augmentation
+
+if TYPE_CHECKING:  # state is slow to import, so is only imported for type checkers
+    from ..inspect.state import FreelancerState
+
+# functions of `flair.hook.input` available to workers, and whether each returns a value which must be waited for
+PROXIED_FUNCTIONS = {
+    'queue_display_text': False,
+    'send_message': False,
+    'inject_keys': False,
+    'inject_text': False,
+    'get_chat_box_contents': True,
+    'get_chat_box_open_hotkey': True,
+}
+
+
+class IsolatedAugmentation(Augmentation):
+    """Runs an augmentation in a worker process, which is restarted if it crashes.
+
+    Events and snapshots are placed in a bounded outbox, which a dedicated thread sends to the worker in order, so a
+    slow or stuck worker never holds up the thread emitting them; if it falls behind, the oldest are dropped. Restarts
+    are delayed exponentially, from `RESTART_DELAY` up to `MAX_RESTART_DELAY` seconds, so that a worker which crashes
+    on start doesn't spin."""
+    SNAPSHOT_PERIOD = 1.0  # how often (in seconds) a snapshot of the state is sent to the worker
+    OUTBOX_SIZE = 1024  # the number of messages which may be waiting to be sent to the worker
+    RESTART_DELAY = 1.0
+    MAX_RESTART_DELAY = 60.0
+    STOP_TIMEOUT = 5.0  # how long (in seconds) to give the worker to unload before it is terminated
+
+    def __init__(self, state: 'FreelancerState', target: str):
+        """`target`: the augmentation to run, as 'package.module:Class'."""
+        super().__init__(state)
+        self.target = target
+        self.restarts = 0  # the number of times the worker has been restarted after crashing
+        self.dropped = 0  # the number of messages discarded because the worker fell behind
+        self._context = multiprocessing.get_context('spawn')  # a forked worker would inherit the hook's threads
+        self._process: Optional[multiprocessing.Process] = None
+        self._connection = None
+        self._send_lock = threading.Lock()
+        self._outbox = collections.deque()
+        self._outbox_ready = threading.Condition()
+        self._stopping = threading.Event()
+        self._hotkeys: Dict[int, Callable[[], None]] = {}  # functions bound as hotkeys on behalf of the worker
+        self._forwarders = []
+        self._snapshot_task = None
+
+    def load(self):
+        self._stopping.clear()
+        self._start_worker()
+        for name, signal in events.SIGNALS.items():
+            forwarder = self._forwarder(name)
+            signal.connect(forwarder)
+            self._forwarders.append((signal, forwarder))
+        self._snapshot_task = scheduler.schedule(self._queue_snapshot, self.SNAPSHOT_PERIOD, name='send snapshot')
+        threading.Thread(target=self._flush, name=f'flair sender ({self.target})', daemon=True).start()
+        threading.Thread(target=self._supervise, name=f'flair supervisor ({self.target})', daemon=True).start()
+
+    def unload(self):
+        scheduler.cancel(self._snapshot_task)
+        for signal, forwarder in self._forwarders:
+            signal.disconnect(forwarder)
+        self._forwarders.clear()
+        with self._outbox_ready:
+            self._stopping.set()
+            self._outbox.clear()
+            self._outbox_ready.notify()
+        self._unbind_hotkeys()
+        self._send(('stop',))
+        self._process.join(self.STOP_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    def _start_worker(self):
+        """Start a worker process and the thread handling its requests."""
+        self._connection, child = self._context.Pipe()
+        self._process = self._context.Process(target=run_worker, args=(self.target, child),
+                                              name=f'flair worker ({self.target})', daemon=True)
+        self._process.start()
+        child.close()
+        threading.Thread(target=self._receive, args=(self._connection,), name=f'flair receiver ({self.target})',
+                         daemon=True).start()
+        self._queue_snapshot()
+
+    def _supervise(self):
+        """Restart the worker whenever it exits unexpectedly."""
+        delay = self.RESTART_DELAY
+        while True:
+            self._process.join()
+            if self._stopping.is_set():
+                return
+            print(f'Augmentation worker for {self.target} exited with code {self._process.exitcode}, restarting in '
+                  f'{delay:g} s', file=sys.stderr)
+            if self._stopping.wait(delay):
+                return
+            self._unbind_hotkeys()  # the new worker will bind its own
+            self._start_worker()
+            self.restarts += 1
+            delay = min(delay * 2, self.MAX_RESTART_DELAY)
+
+    def _queue(self, message: tuple):
+        """Queue a message to be sent to the worker, discarding the oldest queued if the outbox is full."""
+        with self._outbox_ready:
+            if self._stopping.is_set():
+                return
+            if len(self._outbox) >= self.OUTBOX_SIZE:
+                self._outbox.popleft()
+                self.dropped += 1
+            self._outbox.append(message)
+            self._outbox_ready.notify()
+
+    def _flush(self):
+        """Send queued messages to the worker until unloaded."""
+        while True:
+            with self._outbox_ready:
+                while not self._outbox and not self._stopping.is_set():
+                    self._outbox_ready.wait()
+                if self._stopping.is_set():
+                    return
+                message = self._outbox.popleft()
+            self._send(message)
+
+    def _send(self, message: tuple):
+        """Send a message to the worker. Failure to do so, because it has exited, is not an error."""
+        with self._send_lock:
+            try:
+                self._connection.send(message)
+            except (OSError, ValueError):
+                pass
+
+    def _forwarder(self, name: str) -> Callable:
+        def forward(**payload):
+            self._queue(('event', name, payload))
+        return forward
+
+    def _queue_snapshot(self):
+        self._queue(('state', self._state.snapshot()))
+
+    def _receive(self, connection):
+        """Handle requests from a worker until it exits."""
+        from ..hook import input
+        while True:
+            try:
+                kind, *message = connection.recv()
+            except (EOFError, OSError):
+                return
+            if kind == 'call':
+                call_id, function, args, kwargs = message
+                try:
+                    result, error = getattr(input, function)(*args, **kwargs), None
+                except Exception as e:
+                    result, error = None, f'{type(e).__name__}: {e}'
+                if call_id is not None:
+                    self._send(('result', call_id, result, error))  # not queued, as it must not be dropped
+                elif error is not None:
+                    print(f'{self.target}: {function} failed: {error}', file=sys.stderr)
+            elif kind == 'bind_hotkey':
+                combination, hotkey_id = message
+                self._hotkeys[hotkey_id] = function = self._hotkey_forwarder(combination, hotkey_id)
+                input.bind_hotkey(combination, function)
+            elif kind == 'unbind_hotkey':
+                hotkey_id, = message
+                function = self._hotkeys.pop(hotkey_id, None)
+                if function:
+                    input.unbind_hotkey(function.combination, function)
+
+    def _hotkey_forwarder(self, combination: str, hotkey_id: int) -> Callable[[], None]:
+        def forward():
+            self._queue(('hotkey', hotkey_id))
+        forward.combination = combination
+        return forward
+
+    def _unbind_hotkeys(self):
+        from ..hook import input
+        for function in list(self._hotkeys.values()):
+            input.unbind_hotkey(function.combination, function)
+        self._hotkeys.clear()
+
+
+class StateProxy:
+    """Stands in for a `FreelancerState` in a worker process. Its attributes are the fields of the last `State`
+    snapshot received from the main process."""
+
+    def __init__(self):
+        self._snapshot = None
+        self._received = threading.Event()
+
+    def __getattr__(self, name: str) -> Any:
+        self._received.wait()
+        return getattr(self._snapshot, name)
+
+    def snapshot(self):
+        self._received.wait()
+        return self._snapshot
+
+    def _update(self, snapshot):
+        self._snapshot = snapshot
+        self._received.set()
+
+
+class Worker:
+    """The worker-process side of an `IsolatedAugmentation`. Messages are received on a background thread, and events
+    and hotkeys handled in order on the main thread, so that the augmentation's handlers can make proxied calls which
+    wait for a result."""
+    CALL_TIMEOUT = 5.0  # how long (in seconds) to wait for the result of a proxied call
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.state = StateProxy()
+        self._send_lock = threading.Lock()
+        self._pending: queue.Queue = queue.Queue()  # events and hotkeys to be handled on the main thread
+        self._results: Dict[int, queue.Queue] = {}
+        self._call_ids = itertools.count()
+        self._hotkey_ids = itertools.count()
+        self._hotkeys: Dict[int, Callable[[], None]] = {}
+        self._hotkey_ids_by_binding: Dict[tuple, int] = {}
+
+    def send(self, message: tuple):
+        with self._send_lock:
+            self.connection.send(message)
+
+    def call(self, function: str, *args, **kwargs):
+        """Call a function of `flair.hook.input` in the main process, waiting for its result if it returns one."""
+        if not PROXIED_FUNCTIONS[function]:
+            self.send(('call', None, function, args, kwargs))
+            return None
+        call_id = next(self._call_ids)
+        self._results[call_id] = result = queue.Queue(maxsize=1)
+        self.send(('call', call_id, function, args, kwargs))
+        try:
+            value, error = result.get(timeout=self.CALL_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f'No reply to {function} from the main process') from None
+        finally:
+            del self._results[call_id]
+        if error is not None:
+            raise RuntimeError(error)
+        return value
+
+    def bind_hotkey(self, combination: str, function: Callable[[], None]):
+        hotkey_id = next(self._hotkey_ids)
+        self._hotkeys[hotkey_id] = function
+        self._hotkey_ids_by_binding[(combination, function)] = hotkey_id
+        self.send(('bind_hotkey', combination, hotkey_id))
+
+    def unbind_hotkey(self, combination: str, function: Callable[[], None]):
+        hotkey_id = self._hotkey_ids_by_binding.pop((combination, function))
+        self._hotkeys.pop(hotkey_id, None)
+        self.send(('unbind_hotkey', hotkey_id))
+
+    def input_proxy(self) -> types.ModuleType:
+        """Build a module to stand in for `flair.hook.input`."""
+        module = types.ModuleType('flair.hook.input', 'A proxy for flair.hook.input in the main process.')
+        for function in PROXIED_FUNCTIONS:
+            setattr(module, function, lambda *args, _function=function, **kwargs: self.call(_function, *args, **kwargs))
+        module.bind_hotkey = self.bind_hotkey
+        module.unbind_hotkey = self.unbind_hotkey
+        return module
+
+    def receive(self):
+        """Receive messages from the main process until it asks the worker to stop or goes away."""
+        while True:
+            try:
+                kind, *message = self.connection.recv()
+            except (EOFError, OSError):
+                kind, message = 'stop', ()
+            if kind == 'state':
+                self.state._update(message[0])
+            elif kind == 'result':
+                call_id, value, error = message
+                if call_id in self._results:  # the call may have timed out
+                    self._results[call_id].put((value, error))
+            else:
+                self._pending.put((kind, message))
+                if kind == 'stop':
+                    return
+
+    def run(self):
+        """Handle events and hotkeys until asked to stop."""
+        while True:
+            kind, message = self._pending.get()
+            if kind == 'stop':
+                return
+            try:
+                if kind == 'event':
+                    name, payload = message
+                    events.SIGNALS[name].emit(**payload)
+                elif kind == 'hotkey':
+                    function = self._hotkeys.get(message[0])
+                    if function:
+                        function()
+            except Exception:
+                traceback.print_exc()  # an error in one handler must not take down the worker
+
+
+def run_worker(target: str, connection):
+    """The entry point of a worker process: load the augmentation `target` and run it until told to stop."""
+    worker = Worker(connection)
+    proxy = worker.input_proxy()
+    sys.modules['flair.hook.input'] = proxy  # before anything imports the real module
+    import flair.hook
+    flair.hook.input = proxy
+    threading.Thread(target=worker.receive, name='flair worker receiver', daemon=True).start()
+
+    module_name, _, class_name = target.partition(':')
+    augmentation = getattr(importlib.import_module(module_name), class_name)(worker.state)
+    augmentation.load()
+    try:
+        worker.run()
+    finally:
+        augmentation.unload()
@@ -0,0 +1,196 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+import importlib
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+from ..inspect import events
+from . import Augmentation
+
+if TYPE_CHECKING:  # state is slow to import, so is only imported for type checkers
+    from ..inspect.state import FreelancerState
+
+ENTRY_POINT_GROUP = 'flair.augmentations'
+
+
+class AugmentationSpec(NamedTuple):
+    """Describes how to find an augmentation and when to load it, without importing it."""
+    target: str  # the augmentation class, as 'package.module:Class'
+    triggers: Tuple[str, ...] = ()  # load upon the first emission of any of these signals. If empty, load immediately
+    isolated: bool = False  # run in a worker process, so that it can't hold up the poll loop or keyboard hooks
+    # the name of a state variable which is true once any trigger has been emitted, e.g. 'foreground' for
+    # 'switched_to_foreground'. If it is already true when loading is deferred, the augmentation is loaded immediately,
+    # as the trigger may have been emitted before it was connected
+    condition: Optional[str] = None
+
+
+# the augmentations included with flair. Those with heavy dependencies are only loaded once they are needed
+BUILTIN = {
+    'cli': AugmentationSpec('flair.augment.cli:CLI'),
+    'clipboard': AugmentationSpec('flair.augment.clipboard:Clipboard', ('chat_box_opened',), condition='chat_box'),
+    'screenshot': AugmentationSpec('flair.augment.screenshot:Screenshot', ('switched_to_foreground',),
+                                   condition='foreground'),
+}
+
+
+class AugmentationManager:
+    """Discovers, loads and unloads augmentations.
+
+    Augmentations are described by `AugmentationSpec`s. As well as those built in, they are discovered from the
+    `flair.augmentations` entry point group of installed packages. An entry point may refer to either an `Augmentation`
+    subclass, or, so that the module defining it is not imported until it is needed, an `AugmentationSpec`.
+
+    An augmentation with triggers is imported and loaded upon the first emission of one of them. Functions it connects
+    to the triggering signal while loading are then called with that emission's payload, so it doesn't miss the event
+    that caused it to be loaded. An isolated augmentation is run in a worker process; see `IsolatedAugmentation`."""
+
+    def __init__(self, state: 'FreelancerState', specs: Dict[str, AugmentationSpec] = None,
+                 on_load: Callable[[str, float], None] = None):
+        """`state`: the state passed to each augmentation.
+        `specs`: the augmentations to manage, by name. By default, those built in and those discovered.
+        `on_load`: if given, called with the name of each augmentation loaded and the time (in seconds) it took."""
+        self.state = state
+        self.specs = dict(specs) if specs is not None else {**BUILTIN, **discover()}
+        self.on_load = on_load
+        self.instances: Dict[str, Augmentation] = {}
+        self.load_times: Dict[str, float] = {}  # the time (in seconds) taken to import and load each augmentation
+        self._triggers: Dict[str, List[Tuple[events.Signal, Callable]]] = {}  # trigger handlers awaiting each
+        self._lock = threading.RLock()
+
+    def __iter__(self) -> Iterator[Augmentation]:
+        return iter(list(self.instances.values()))
+
+    def __len__(self) -> int:
+        return len(self.instances)
+
+    def start(self):
+        """Load every augmentation without triggers, and wait for the triggers of the rest. An augmentation which fails
+        to load is reported and skipped, so that it doesn't prevent the others from loading."""
+        for name, spec in self.specs.items():
+            try:
+                if spec.triggers:
+                    self.defer(name)
+                else:
+                    self.load(name)
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self):
+        """Unload every augmentation and stop waiting for triggers."""
+        with self._lock:
+            for name in list(self._triggers):
+                self._cancel_triggers(name)
+            for name in list(self.instances):
+                self.unload(name)
+
+    def defer(self, name: str):
+        """Load an augmentation upon the first emission of one of its triggers, or now if its condition is already
+        true."""
+        with self._lock:
+            if name in self.instances or name in self._triggers:
+                return
+            spec = self.specs[name]
+            connections = []
+            for signal_name in spec.triggers:
+                signal = events.SIGNALS[signal_name]
+                handler = self._trigger_handler(name, signal)
+                signal.connect(handler)
+                connections.append((signal, handler))
+            self._triggers[name] = connections
+            if spec.condition and getattr(self.state, spec.condition):  # checked after connecting, so none is missed
+                self.load(name)
+
+    def load(self, name: str) -> Augmentation:
+        """Import, instantiate and load an augmentation now, if it is not already loaded."""
+        with self._lock:
+            if name in self.instances:
+                return self.instances[name]
+            self._cancel_triggers(name)
+            start = time.perf_counter()
+            spec = self.specs[name]
+            if spec.isolated:
+                from .isolation import IsolatedAugmentation  # imported here as few augmentations need it
+                augmentation = IsolatedAugmentation(self.state, spec.target)
+            else:
+                module_name, _, class_name = spec.target.partition(':')
+                augmentation = getattr(importlib.import_module(module_name), class_name)(self.state)
+            augmentation.load()
+            self.load_times[name] = time.perf_counter() - start
+            self.instances[name] = augmentation
+            if self.on_load:
+                self.on_load(name, self.load_times[name])
+            return augmentation
+
+    def unload(self, name: str):
+        """Unload an augmentation. It can be loaded again with `load`."""
+        with self._lock:
+            augmentation = self.instances.pop(name, None)
+            if augmentation is not None:
+                augmentation.unload()
+
+    def reload(self, name: str) -> Augmentation:
+        """Unload an augmentation, reload the module defining it so that changes to its code take effect, and load it
+        again."""
+        with self._lock:
+            self.unload(name)
+            module_name = self.specs[name].target.partition(':')[0]
+            if module_name in sys.modules:  # an isolated augmentation's worker imports it afresh anyway
+                importlib.reload(sys.modules[module_name])
+            return self.load(name)
+
+    def _trigger_handler(self, name: str, signal: events.Signal) -> Callable:
+        """Build a function which loads an augmentation when `signal` is emitted."""
+        def trigger(**payload):
+            with self._lock:
+                if name in self.instances:
+                    return
+                before = set(signal)
+                try:
+                    self.load(name)
+                except Exception:
+                    traceback.print_exc()  # a broken augmentation must not stop the signal reaching others
+                    return
+                added = [h for h in signal if h not in before]
+            for handler in added:  # these missed this emission, as they were connected during it
+                handler(**payload)
+        return trigger
+
+    def _cancel_triggers(self, name: str):
+        """Stop waiting for an augmentation's triggers."""
+        for signal, handler in self._triggers.pop(name, ()):
+            signal.disconnect(handler)
+
+
+def discover() -> Dict[str, AugmentationSpec]:
+    """Find the augmentations provided by installed packages through the `flair.augmentations` entry point group."""
+    try:
+        from importlib.metadata import entry_points  # Python 3.8+
+        found = entry_points()
+        found = found.select(group=ENTRY_POINT_GROUP) if hasattr(found, 'select') else found.get(ENTRY_POINT_GROUP, ())
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return {}
+        found = pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+
+    specs = {}
+    for entry_point in found:
+        try:
+            provided = entry_point.load()
+        except Exception:
+            traceback.print_exc()
+            continue
+        if isinstance(provided, AugmentationSpec):
+            specs[entry_point.name] = provided
+        elif isinstance(provided, type) and issubclass(provided, Augmentation):
+            specs[entry_point.name] = AugmentationSpec(f'{provided.__module__}:{provided.__qualname__}')
+    return specs
@@ -5,10 +5,12 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
-
-from PIL import ImageGrab
+import threading
+import time
+from typing import Optional
 
 from ..hook import window, input
 from .. import platforms
@@ -16,23 +18,60 @@ from . import Augmentation
 
 
 class Screenshot(Augmentation):
-    """Adds proper screenshot functionality to the game."""
+    """Adds proper screenshot functionality to the game.
+
+    Only capturing the window happens on the thread running the hotkey; encoding and writing the image to disk are
+    handed to a pool of worker threads, so that hotkeys stay responsive."""
     HOTKEY = 'ctrl+prtscn' if platforms.WIN32 else 'ctrl+compose'
+    BURST_HOTKEY = 'ctrl+shift+prtscn' if platforms.WIN32 else 'ctrl+shift+compose'
     screenshots_root_dir = os.path.expanduser('~/Documents/My Games/Freelancer/Screenshots')
+    image_format = 'png'  # any format Pillow can write, e.g. 'png', 'jpeg' or 'webp'
+    compression = 1  # for PNG, the zlib compression level (0-9); higher levels are much slower for little gain
+    quality = 90  # for lossy formats, like JPEG and WebP
+    burst_count = 10  # the number of screenshots taken by the burst hotkey
+    burst_interval = 0.1  # the time (in seconds) between screenshots in a burst
+    workers = 2  # the number of threads encoding and saving screenshots
 
     def load(self):
         os.makedirs(self.screenshots_root_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='flair screenshot')
+        self._unloaded = threading.Event()  # set to stop any burst in progress
         input.bind_hotkey(self.HOTKEY, self.take_screenshot)
+        input.bind_hotkey(self.BURST_HOTKEY, self.take_burst)
 
     def unload(self):
         input.unbind_hotkey(self.HOTKEY, self.take_screenshot)
+        input.unbind_hotkey(self.BURST_HOTKEY, self.take_burst)
+        self._unloaded.set()
+        self._pool.shutdown(wait=False)  # screenshots already taken are still saved
 
     def take_screenshot(self):
-        """Take and save am auto-named screenshot"""
-        character_name = self._state.name
-        system_name = self._state.system
-        date = datetime.now().strftime('%y-%m-%d %H.%M.%S')  # in practice only one screenshot can be taken per second
+        """Take an auto-named screenshot, and queue it to be saved. Nothing is taken if the game's window has gone."""
+        image = window.capture()
+        if image is None:
+            return
+        taken = datetime.now()
+        try:
+            self._pool.submit(self._save, image, taken, self._state.name, self._state.system)
+        except RuntimeError:  # unloaded as the screenshot was taken
+            pass
+
+    def take_burst(self):
+        """Take `burst_count` screenshots, `burst_interval` seconds apart, on a separate thread."""
+        threading.Thread(target=self._burst, name='flair screenshot burst', daemon=True).start()
+
+    def _burst(self):
+        start = time.monotonic()
+        for i in range(self.burst_count):
+            self.take_screenshot()
+            if self._unloaded.wait(max(0.0, start + (i + 1) * self.burst_interval - time.monotonic())):
+                return
+
+    def _save(self, image, taken: datetime, character_name: Optional[str], system_name: Optional[str]):
+        """Encode and save a screenshot. Screenshots are named with the time they were taken to the millisecond, so
+        several can be taken per second."""
+        date = taken.strftime('%y-%m-%d %H.%M.%S.%f')[:-3]
         directory_path = os.path.join(self.screenshots_root_dir, str(character_name))
-        file_path = os.path.join(directory_path, f'{date} {system_name}.png')
+        file_path = os.path.join(directory_path, f'{date} {system_name}.{self.image_format.lower()}')
         os.makedirs(directory_path, exist_ok=True)
-        ImageGrab.grab(window.get_screen_coordinates()).save(file_path, 'PNG')
+        image.save(file_path, self.image_format.upper(), compress_level=self.compression, quality=self.quality)
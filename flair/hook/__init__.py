@@ -5,6 +5,25 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
- This file ensures all hook components are initialised.
+ Hook components are imported upon first access, so that using one (e.g. `process`) does not pull in the
+ dependencies of the others (e.g. keyboard for `input`).
 """
-from . import input, process, storage, window
+import importlib
+import sys
+
+COMPONENTS = {'input', 'process', 'storage', 'watch', 'window'}
+
+
+def __getattr__(name: str):
+    """Import a hook component upon first access."""
+    if name in COMPONENTS:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | COMPONENTS)
+
+
+if sys.version_info < (3, 7):  # module __getattr__ is not supported, so import everything up front
+    from . import input, process, storage, watch, window
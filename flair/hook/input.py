@@ -5,14 +5,19 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
+import collections
+import textwrap
+import threading
+import traceback
 from types import FunctionType
 
 import time
-from typing import List, Tuple
+from typing import Deque, List, Optional, Tuple
 
 import keyboard
 
 from . import process, window, storage
+from .watch import dialogue_watcher
 from ..inspect.events import message_sent, chat_box_closed, chat_box_opened  # emits
 from ..inspect.events import switched_to_background, switched_to_foreground  # utilises
 
@@ -21,31 +26,208 @@ ECHO_PREAMBLE = '/=/  '  # see docstring for send_message
 KEY_SEND_MESSAGE = 'enter'  # unlike the hotkey to open the chat box, these keys are hardcoded
 KEY_CLOSE_CHAT_BOX = 'esc'
 KEY_CHANGE_CHAT_CHANNEL = 'up'
-
-chat_box_events: List[keyboard.KeyboardEvent] = []
+MESSAGE_SEPARATOR = ' | '  # joins short lines which are merged into one message
+INJECTION_TIMEOUT = 1.0  # seconds after which an injected keystroke not yet seen by the keyboard hook is given up on
+
+
+class ChatBoxBuffer:
+    """A model of the text being edited in the chat box, updated incrementally as keys are pressed.
+
+    The text is held as two stacks of characters either side of the cursor, so typing, deleting and moving the cursor
+    one character are all O(1) (moving to the start or end is proportional to the distance moved). Like the chat box
+    itself, the buffer holds at most `max_length` characters, so its memory is bounded however long the box is open.
+
+    Text pasted with the game's own Ctrl+V is not tracked, as keys pressed with Ctrl held are ignored and the clipboard
+    is not read; text pasted through `inject_text` (as by the Clipboard augmentation) is."""
+
+    def __init__(self, max_length=storage.CHAT_MESSAGE_MAX_LENGTH):
+        self.max_length = max_length
+        self._before: List[str] = []  # the characters before the cursor
+        self._after: List[str] = []  # the characters after the cursor, in reverse order
+        self._shift = self._caps_lock = self._modifier = False  # the state of keys that change what a key types
+        # characters injected by `inject_text` yet to be seen, and the time by which each is expected
+        self._injected: Deque[Tuple[str, float]] = collections.deque()
+
+    def __len__(self):
+        return len(self._before) + len(self._after)
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._before) + ''.join(reversed(self._after))
+
+    @property
+    def cursor(self) -> int:
+        """The position of the cursor, as the number of characters before it."""
+        return len(self._before)
+
+    def clear(self):
+        self._before.clear()
+        self._after.clear()
+        self._injected.clear()
+
+    def insert(self, text: str):
+        """Insert text at the cursor, truncated to fit within `max_length`."""
+        self._before.extend(text[:self.max_length - len(self)])
+
+    def inject(self, text: str):
+        """Insert text which is about to be typed by injecting keystrokes, so that those keystrokes are not counted
+        again when they are seen by the keyboard hook. Keystrokes not seen within `INJECTION_TIMEOUT` seconds are
+        assumed to have been lost."""
+        self.insert(text)
+        deadline = time.monotonic() + INJECTION_TIMEOUT
+        self._injected.extend((c, deadline) for c in text)
+
+    def handle(self, event: keyboard.KeyboardEvent):
+        """Update the buffer for a keyboard event."""
+        name = event.name or ''
+        down = event.event_type == keyboard.KEY_DOWN
+        if 'shift' in name:
+            self._shift = down
+        elif 'ctrl' in name or 'alt' in name:
+            self._modifier = down
+        elif not down:
+            return
+        elif name == 'caps lock':
+            self._caps_lock = not self._caps_lock
+        elif name == 'space' or len(name) == 1:
+            character = ' ' if name == 'space' else name.upper() if self._shift ^ self._caps_lock else name
+            now = time.monotonic()
+            while self._injected and self._injected[0][1] < now:
+                self._injected.popleft()  # lost, so must not swallow a later keystroke typed by the user
+            if self._injected and character == self._injected[0][0]:
+                self._injected.popleft()  # typed by inject_text, so already inserted
+            elif not self._modifier:  # characters typed with ctrl or alt held are hotkeys, not text
+                self.insert(character)
+        elif name == 'backspace' and self._before:
+            self._before.pop()
+        elif name == 'delete' and self._after:
+            self._after.pop()
+        elif name == 'left' and self._before:
+            self._after.append(self._before.pop())
+        elif name == 'right' and self._after:
+            self._before.append(self._after.pop())
+        elif name == 'home':
+            self._after.extend(reversed(self._before))
+            self._before.clear()
+        elif name == 'end':
+            self._before.extend(reversed(self._after))
+            self._after.clear()
+
+
+chat_box = ChatBoxBuffer()  # the contents of the chat box while it is open
 message_queue: List[str] = []  # messages to be shown to player
 hotkeys: List[Tuple[str, FunctionType]] = []
 
 
+class MessageDispatcher:
+    """Sends messages queued by `queue_display_text` on a thread of its own, so that queueing never blocks the caller.
+
+    Queued text is split into chunks which fit in a single message: at each line break, as a line break would send the
+    chat box's contents, and wherever a line is too long, preferably between words. Other whitespace is preserved.
+    Consecutive short chunks are merged into one message (separated by `MESSAGE_SEPARATOR`) so as not to flood the
+    chat. Messages are sent at most `rate` times per second, and only while Freelancer is in the foreground, a character
+    is loaded and the chat box is closed. The dispatcher is woken as soon as the chat box closes. If sending a message
+    fails, e.g. because the game was put into the background as it was being sent, it is queued to be sent again."""
+
+    def __init__(self, rate=2.0, max_length=storage.CHAT_MESSAGE_MAX_LENGTH - len(ECHO_PREAMBLE)):
+        """`rate`: the maximum number of messages to send per second.
+        `max_length`: the maximum length of a message, allowing for any preamble added by `send_message`."""
+        self.rate = rate
+        self.max_length = max_length
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, text: str):
+        """Queue text to be sent."""
+        with self._condition:
+            for line in text.splitlines():
+                message_queue.extend(textwrap.wrap(line, self.max_length, replace_whitespace=False,
+                                                   drop_whitespace=False))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='flair message dispatcher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def wake(self):
+        """Check whether queued messages can now be sent."""
+        with self._condition:
+            self._condition.notify()
+
+    def _run(self):
+        """Send queued messages whenever they can be sent."""
+        try:
+            while True:
+                with self._condition:
+                    # woken when text is queued or the chat box closes; the timeout catches other changes, like the
+                    # game being brought into the foreground
+                    if not self._condition.wait_for(lambda: message_queue and self._can_send(), timeout=1.0):
+                        continue
+                    message = self._next_message()
+                try:
+                    send_message(message)
+                except Exception:
+                    traceback.print_exc()
+                    with self._condition:
+                        message_queue.insert(0, message)  # to be sent once it can be
+                time.sleep(1 / self.rate)
+        finally:
+            with self._condition:
+                self._thread = None  # so that `submit` starts another
+
+    def _next_message(self) -> str:
+        """Take the next message to send from the queue, merging as many queued chunks into it as will fit."""
+        message = message_queue.pop(0)
+        while message_queue and len(message) + len(MESSAGE_SEPARATOR) + len(message_queue[0]) <= self.max_length:
+            message += MESSAGE_SEPARATOR + message_queue.pop(0)
+        return message
+
+    @staticmethod
+    def _can_send() -> bool:
+        """Whether messages can be sent now. If this can't be determined, e.g. because the game has just exited, they
+        can't."""
+        try:
+            if not window.is_foreground():
+                return False
+            handle = process.get_process()
+            return process.get_character_loaded(handle) and not process.get_chat_box_state(handle)
+        except Exception:
+            traceback.print_exc()
+            return False
+
+
+dispatcher = MessageDispatcher()
+
+
 def bind_hotkey(combination, function):
-    """Adds a hotkey which is only active when Freelancer is in the foreground."""
+    """Adds a hotkey which is only active when Freelancer is in the foreground. If hotkeys are currently active, it
+    takes effect immediately."""
     assert callable(function)
     hotkeys.append((combination, function))
+    if _hotkeys_active():
+        keyboard.add_hotkey(combination, function)
 
 
 def unbind_hotkey(combination, function):
-    """Removes a hotkey that has been bound in the Freelancer window."""
+    """Removes a hotkey that has been bound in the Freelancer window. If hotkeys are currently active, it stops
+    working immediately."""
     hotkeys.remove((combination, function))
+    if _hotkeys_active():
+        try:
+            keyboard.remove_hotkey(combination)
+        except KeyError:
+            pass
+
+
+def _hotkeys_active() -> bool:
+    """Whether bound hotkeys are currently hooked, i.e. Freelancer is in the foreground and the chat box is closed."""
+    return window.is_foreground() and not process.get_chat_box_state(process.get_process())
 
 
 def queue_display_text(text: str):
     """Queue text to be displayed to the user. If Freelancer is in the foreground and the chat box is closed,
-    this will be shown immediately. Otherwise, the text will be shown as soon as both these conditions are true."""
-    time.sleep(.1)  # wait for chat box state to propagate
-    if window.is_foreground() and not process.get_chat_box_state(process.get_process()):  # show immediately
-        send_message(text)
-    else:
-        message_queue.append(text)
+    this will be shown immediately. Otherwise, the text will be shown as soon as both these conditions are true.
+    Returns immediately; text is sent by `dispatcher`."""
+    dispatcher.submit(text)
 
 
 def send_message(message: str, private=True):
@@ -78,6 +260,7 @@ def inject_keys(key: str, after_delay=0.0):
 def inject_text(text: str):
     """Inject text into the chat box."""
     assert process.get_chat_box_state(process.get_process())
+    chat_box.inject(text)
     keyboard.write(text)
 
 
@@ -111,10 +294,10 @@ def terminate_hotkey_hooks():
 def on_chat_box_opened():
     """Handle the user opening the chat box. Emits the `chat_box_opened` signal."""
     if window.is_foreground():
-        handle = process.get_process()
-        if _wait_until(lambda: process.get_chat_box_state(handle)):
+        if dialogue_watcher.wait_until(process.get_chat_box_state):
             terminate_hotkey_hooks()
             # begin capturing keystrokes
+            chat_box.clear()
             keyboard.hook(collect_chat_box_events)
             # add hooks for close
             keyboard.add_hotkey(KEY_SEND_MESSAGE, on_chat_box_closed, args=[False])
@@ -128,12 +311,8 @@ def on_chat_box_opened():
 def on_chat_box_closed(cancelled=False):
     """Handle the user closing the chat box. Emits the `chat_box_closed` signal."""
     if window.is_foreground():
-        handle = process.get_process()
-        if _wait_until(lambda: not process.get_chat_box_state(handle)):
-            # print queued messages
-            if process.get_character_loaded(process.get_process()):
-                while message_queue:
-                    send_message(message_queue.pop(0))
+        if dialogue_watcher.wait_until(lambda dialogues: not process.get_chat_box_state(dialogues)):
+            dispatcher.wake()  # print queued messages
             # emit signals
             contents = get_chat_box_contents()
             sent = not cancelled and contents
@@ -143,22 +322,20 @@ def on_chat_box_closed(cancelled=False):
             terminate_hotkey_hooks()
             # add hook for open
             keyboard.add_hotkey(get_chat_box_open_hotkey(), on_chat_box_opened)
-            # clear events
-            chat_box_events.clear()
+            chat_box.clear()
         else:
             initialise_hotkey_hooks()
 
 
 def collect_chat_box_events(event):
-    """Handle a keyboard event while the chat box is open.
-    # Todo: handle arrow keys, copy and paste"""
+    """Handle a keyboard event while the chat box is open."""
     if window.is_foreground():
-        chat_box_events.append(event)
+        chat_box.handle(event)
 
 
 def get_chat_box_contents():
     """Return (our best guess at) the current contents of the chat box. If it is closed, returns a blank string."""
-    return ''.join(keyboard.get_typed_strings(chat_box_events, allow_backspace=True))
+    return chat_box.text
 
 
 def get_chat_box_open_hotkey():
@@ -166,14 +343,5 @@ def get_chat_box_open_hotkey():
     return storage.get_user_keymap()['user_chat']
 
 
-def _wait_until(condition, timeout=0.1):
-    """Block until condition returns True, or the timeout (in seconds) is reached. Return True if condition became
-    true before the timeout, otherwise False."""
-    start = time.time()
-    while not condition() and (time.time() - start) < timeout:
-        continue
-    return condition()
-
-
 switched_to_foreground.connect(initialise_hotkey_hooks)
 switched_to_background.connect(terminate_hotkey_hooks)
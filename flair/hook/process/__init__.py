@@ -5,8 +5,10 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
-from typing import Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from ctypes import c_float, c_uint, c_uint32, sizeof, Array
+import functools
+import threading
 
 from ... import platforms
 
@@ -28,10 +30,91 @@ READ_ADDRESSES = {
     'in_space':       (0x673560, c_uint32),  # whether the player is in space (not docked) (possibly also 0x673530)
 }
 
+POINTER_SIZE = 4  # Freelancer is a 32-bit program
+
+# the maximum length, in characters, of each of the strings above
+STRING_LENGTHS = {
+    'last_message': 127,
+    'mouseover':    128,
+    'rollover':     128,
+    'name':         23,
+}
+
+# addresses found by following a chain of pointers, registered with `register_pointer`. Maps each key in
+# `READ_ADDRESSES` to the static base pointer and offsets its address is resolved from
+POINTER_CHAINS: Dict[str, Tuple[int, Tuple[int, ...]]] = {}
+# for each process handle, the value of each chain's base pointer when its address was last resolved, and that address.
+# Resolved addresses differ between instances of the game, so are never written to `READ_ADDRESSES`
+_resolved: Dict[int, Dict[str, Tuple[int, int]]] = {}
+_resolved_lock = threading.Lock()
+
+
+class Snapshot(dict):
+    """The values of a set of addresses, all read from memory at the same instant. A snapshot can be passed in place of
+    a process handle to any of the `get_` functions below, in which case values are taken from it instead of being
+    read."""
+
+
+def register_address(key: str, address: int, datatype: type, length: int = None):
+    """Register an address to be read alongside those in `READ_ADDRESSES`. `datatype` may be any ctypes type, including
+    a `Structure` describing a memory layout, or `str`, in which case `length` is the string's maximum length in
+    characters."""
+    if datatype is str and not length:
+        raise ValueError('The maximum length of a string address must be specified')
+    READ_ADDRESSES[key] = (address, datatype)
+    if datatype is str:
+        STRING_LENGTHS[key] = length
+    POINTER_CHAINS.pop(key, None)
+    with _resolved_lock:
+        for chains in _resolved.values():
+            chains.pop(key, None)
+    _compile.cache_clear()
+
+
+def register_pointer(key: str, base: int, offsets: Tuple[int, ...], datatype: type, length: int = None):
+    """Register an address which is found by following a chain of pointers, in the manner of Cheat Engine: the
+    pointer at the static address `base` is read, and for every offset but the last, the pointer at that offset from
+    it is read in turn. The address is then the last offset from the last pointer. `datatype` and `length` are as for
+    `register_address`.
+
+    The chain is only followed again when the value of the base pointer changes, which is checked before each read
+    of the address at the cost of one extra (batched) read."""
+    if not offsets:
+        raise ValueError('A pointer chain needs at least one offset; use register_address for a static address')
+    register_address(key, 0, datatype, length)  # the address is resolved for each process as it is read
+    POINTER_CHAINS[key] = (base, tuple(offsets))
+
+
+def read_snapshot(process: Union['HANDLE', Snapshot], keys: Iterable[str] = None) -> Snapshot:
+    """Read the values of the addresses named by `keys` (by default, all registered addresses) in a single batch, so
+    that every value comes from the same instant. On Linux this is a single syscall. The value of an address found
+    through a pointer chain which can't currently be followed is None."""
+    if isinstance(process, Snapshot):
+        return process
+    keys = tuple(keys or READ_ADDRESSES)
+    spans = _spans(process, keys)
+    return Snapshot((k, _decode(READ_ADDRESSES[k][1], raw, size) if address else None)
+                    for k, (address, size), raw in zip(keys, spans, _read_spans(process, spans)))
+
+
+def read_raw(process: 'HANDLE', keys: Iterable[str]) -> Dict[str, Optional[bytes]]:
+    """Read the undecoded bytes at the addresses named by `keys` in a single batch. Comparing these is much cheaper than
+    decoding them, so this is useful when values are read often but rarely change. None is given for any address that
+    could not be read."""
+    keys = tuple(keys)
+    return dict(zip(keys, _read_spans(process, _spans(process, keys))))
+
 
 def get_value(process: 'HANDLE', key, size=None):
-    """Read a value from memory. `key` refers to the key of an address in `READ_ADDRESSES`"""
+    """Read a value from memory. `key` refers to the key of an address in `READ_ADDRESSES`. If the address is found
+    through a pointer chain which can't currently be followed, None is returned."""
+    if isinstance(process, Snapshot):
+        return process[key]
     address, datatype = READ_ADDRESSES[key]
+    if key in POINTER_CHAINS:
+        address = _follow_pointers(process, (key,))[key]
+        if not address:
+            return None
     return read_memory(process, address, datatype, buffer_size=size or (sizeof(datatype) * 8))
 
 
@@ -42,7 +125,7 @@ def get_string(process: 'HANDLE', key, length):
 
 def get_name(process: 'HANDLE') -> str:
     """Read the name of the active character from memory."""
-    return get_string(process, 'name', 23)
+    return get_string(process, 'name', STRING_LENGTHS['name'])
 
 
 def get_credits(process: 'HANDLE') -> int:
@@ -52,7 +135,8 @@ def get_credits(process: 'HANDLE') -> int:
 
 def get_position(process: 'HANDLE') -> Tuple[float, float, float]:
     """Read the position of the active character from memory."""
-    return get_value(process, 'pos_x'), get_value(process, 'pos_y'), get_value(process, 'pos_z')
+    values = read_snapshot(process, ('pos_x', 'pos_y', 'pos_z'))  # read together so coordinates can't be torn
+    return values['pos_x'], values['pos_y'], values['pos_z']
 
 
 def get_mouseover(process: 'HANDLE') -> str:
@@ -61,23 +145,24 @@ def get_mouseover(process: 'HANDLE') -> str:
     and planets immediately upon jumping in or docking, to the prices of commodities in the trader screen, to
     mission "popups" messages, to the name of some solars and NPCs that are moused over while in space.
     With some imagination this can probably be put to some use..."""
-    return get_string(process, 'mouseover', 128)
+    return get_string(process, 'mouseover', STRING_LENGTHS['mouseover'])
 
 
 def get_rollover(process: 'HANDLE') -> str:
     """Similar to mouseover, but usually contains tooltip text."""
-    return get_string(process, 'rollover', 128)
+    return get_string(process, 'rollover', STRING_LENGTHS['rollover'])
 
 
 def get_last_message(process: 'HANDLE') -> str:
     """Read the last message sent by the player from memory"""
-    return get_string(process, 'last_message', 127)
+    return get_string(process, 'last_message', STRING_LENGTHS['last_message'])
 
 
 def get_chat_box_state(process: 'HANDLE') -> bool:
     """Read the state of the chat box from memory."""
-    dialogue_hooking_enter = get_value(process, 'enter_dialogue')
-    dialogue_focused = get_value(process, 'focus_dialogue')
+    values = read_snapshot(process, ('enter_dialogue', 'focus_dialogue'))
+    dialogue_hooking_enter = values['enter_dialogue']
+    dialogue_focused = values['focus_dialogue']
     return bool(dialogue_hooking_enter and not dialogue_focused)
 
 
@@ -93,10 +178,89 @@ def get_docked(process: 'HANDLE') -> bool:
 
 def buffer_as_utf16(buffer: Array) -> str:
     """Decode a null-padded ctypes char array as a UTF-16 string."""
-    return buffer.raw.decode('utf-16').partition('\0')[0]
+    return bytes_as_utf16(buffer.raw)
+
+
+def bytes_as_utf16(raw: bytes) -> str:
+    """Decode null-padded bytes as a UTF-16 string."""
+    return raw.decode('utf-16').partition('\0')[0]
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(keys: Tuple[str, ...]) -> Tuple[Tuple[int, int], ...]:
+    """Compile a tuple of keys into the (address, size) spans to be read for them."""
+    spans = []
+    for key in keys:
+        address, datatype = READ_ADDRESSES[key]
+        size = (STRING_LENGTHS[key] * 2) + 2 if datatype is str else sizeof(datatype)
+        spans.append((address, size))
+    return tuple(spans)
+
+
+def _spans(process: 'HANDLE', keys: Tuple[str, ...]) -> Tuple[Tuple[int, int], ...]:
+    """Return the (address, size) spans to be read for `keys` from a process, with the addresses of any found through
+    pointer chains resolved for that process."""
+    spans = _compile(keys)
+    if not POINTER_CHAINS:
+        return spans
+    resolved = _follow_pointers(process, keys)
+    if not resolved:
+        return spans
+    return tuple((resolved.get(k, address), size) for k, (address, size) in zip(keys, spans))
+
+
+def _read_spans(process: 'HANDLE', spans: Tuple[Tuple[int, int], ...]) -> List[Optional[bytes]]:
+    """Read spans in a single batch, leaving out any at address 0 - those of pointer chains which can't currently be
+    followed - so that they can't affect how the others are read. None is given for those and any that fail."""
+    raws = iter(read_memory_batch(process, tuple(span for span in spans if span[0])))
+    return [next(raws) if address else None for address, _ in spans]
+
+
+def _follow_pointers(process: 'HANDLE', keys: Tuple[str, ...]) -> Dict[str, int]:
+    """Resolve the addresses in a process of any of `keys` which are found through pointer chains, reading all their
+    base pointers in one batch and following the rest of a chain only if its base pointer has changed since it was
+    last followed in that process. Returns the resolved address of each."""
+    chained = [k for k in keys if k in POINTER_CHAINS]
+    if not chained:
+        return {}
+    bases = read_memory_batch(process, tuple((POINTER_CHAINS[k][0], POINTER_SIZE) for k in chained))
+    with _resolved_lock:
+        cached = dict(_resolved.get(int(process), ()))
+
+    addresses = {}
+    for key, raw in zip(chained, bases):
+        base = pointer = int.from_bytes(raw, 'little') if raw is not None else 0
+        if key in cached and cached[key][0] == base:
+            addresses[key] = cached[key][1]
+            continue
+        *intermediate, last = POINTER_CHAINS[key][1]
+        for offset in intermediate:
+            if not pointer:
+                break
+            raw, = read_memory_batch(process, ((pointer + offset, POINTER_SIZE),))
+            pointer = int.from_bytes(raw, 'little') if raw is not None else 0
+        # a null pointer anywhere in the chain leaves the address at 0, which cannot be read
+        addresses[key] = pointer + last if pointer else 0
+        cached[key] = (base, addresses[key])
+
+    with _resolved_lock:
+        _resolved.setdefault(int(process), {}).update(cached)
+    return addresses
+
+
+def _decode(datatype: type, raw: Optional[bytes], size: int) -> Any:
+    """Convert raw bytes read from memory to a value of `datatype`. If the read failed (`raw` is None), the value is
+    decoded from zeroes instead."""
+    raw = raw if raw is not None else bytes(size)
+    if datatype is str:
+        return bytes_as_utf16(raw)
+    value = datatype.from_buffer_copy(raw)
+    return getattr(value, 'value', value)  # C type -> Python type, effectively; structures are returned as-is
 
 
 if platforms.WIN32:
-    from .win32 import get_process, read_memory
+    from .win32 import get_process, read_memory, read_memory_batch, add_exit_listener, remove_exit_listener, \
+        get_processes
 elif platforms.LINUX:
-    from .linux import get_process, read_memory
+    from .linux import get_process, read_memory, read_memory_batch, add_exit_listener, remove_exit_listener, \
+        get_processes
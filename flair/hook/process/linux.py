@@ -7,13 +7,21 @@
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 import ctypes
-from subprocess import check_output, CalledProcessError
+import functools
+import os
+import re
+import select
+import threading
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
 
 from . import buffer_as_utf16
 
 
 libc = ctypes.CDLL('libc.so.6')
 process_vm_read = libc.process_vm_readv  # <https://linux.die.net/man/2/process_vm_readv>
+IOV_MAX = 1024  # the maximum number of iovecs that can be passed to process_vm_readv at once
+SYS_PIDFD_OPEN = 434  # <https://man7.org/linux/man-pages/man2/pidfd_open.2.html>
+PROCESS_NAME = 'Freelancer.exe'
 
 
 class iovec(ctypes.Structure):
@@ -23,14 +31,182 @@ class iovec(ctypes.Structure):
 
 process_vm_read.argtypes = [ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_ulong,
                             ctypes.POINTER(iovec), ctypes.c_ulong, ctypes.c_ulong]
+process_vm_read.restype = ctypes.c_ssize_t
 
 
-def get_process() -> int:
-    """Return a handle to Freelancer's process."""
+class ProcessLocator:
+    """Locates Freelancer's process by scanning /proc, caching its pid.
+
+    Before a cached pid is trusted, its start time is checked against the one recorded when it was found, so that a
+    pid reused by another process is never mistaken for the game. Where the kernel supports pidfd_open (Linux 5.3+), a
+    thread instead waits on a pidfd for the game to exit, clearing the cache and notifying listeners immediately."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.exit_listeners: List[Callable[[], None]] = []
+        self.pid = 0
+        self.start_time = None
+        self.watched = False  # whether the cached pid is being watched through a pidfd
+
+    def get_pid(self) -> int:
+        """Return the pid of the process, or zero if it is not running."""
+        with self.lock:
+            if self.pid and (self.watched or read_stat(self.pid)[1] == self.start_time):
+                return self.pid
+            self.pid, self.start_time = find_process(self.name)
+            if self.pid:
+                pid = self.pid
+                self.watched = watch_exit(pid, self.start_time, lambda: self._exited(pid))
+            return self.pid
+
+    def _exited(self, pid: int):
+        """Handle the process with the given pid exiting: clear the cache and notify listeners."""
+        with self.lock:
+            if self.pid == pid:
+                self.pid, self.start_time, self.watched = 0, None, False
+        for listener in list(self.exit_listeners):
+            listener()
+
+
+def watch_exit(pid: int, start_time: int, callback: Callable[[], None]) -> bool:
+    """Wait in a background thread for a process, identified by its pid and start time, to exit, then call `callback`.
+    Return whether this was possible."""
+    try:
+        pidfd = pidfd_open(pid)
+    except OSError:
+        return False
+    if read_stat(pid)[1] != start_time:  # pid was reused before the pidfd was opened
+        os.close(pidfd)
+        return False
+
+    def wait():
+        poll = select.poll()
+        poll.register(pidfd, select.POLLIN)  # a pidfd becomes readable when its process exits
+        poll.poll()
+        os.close(pidfd)
+        callback()
+
+    threading.Thread(target=wait, name=f'flair exit watcher ({pid})', daemon=True).start()
+    return True
+
+
+def read_stat(pid: int) -> Tuple[Optional[str], Optional[int]]:
+    """Read the name and start time (in clock ticks since boot) of a process from /proc/<pid>/stat. Returns
+    (None, None) if the process does not exist."""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None, None
+    head, _, tail = stat.rpartition(b')')  # the name is parenthesised and may itself contain spaces or parentheses
+    return head.partition(b'(')[2].decode(errors='replace'), int(tail.split()[19])
+
+
+def find_process(name: str) -> Tuple[int, Optional[int]]:
+    """Scan /proc for a process called `name` in the same way as pidof, i.e. by its name or the basename of its first
+    argument. Returns its pid and start time, or (0, None) if there is no such process."""
+    return next(find_processes(name), (0, None))
+
+
+def find_processes(name: str) -> Iterator[Tuple[int, int]]:
+    """Scan /proc for every process called `name`, yielding the pid and start time of each."""
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        pid = int(entry.name)
+        process_name, start_time = read_stat(pid)
+        if process_name is None:
+            continue
+        if process_name == name[:15] or _argv0_name(pid) == name:  # the kernel truncates names to 15 characters
+            yield pid, start_time
+
+
+def _argv0_name(pid: int) -> str:
+    """Return the basename of a process's first argument. Wine processes may use either path separator."""
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            argv0 = f.read().partition(b'\0')[0].decode(errors='replace')
+    except OSError:
+        return ''
+    return re.split(r'[\\/]', argv0)[-1]
+
+
+class Region(NamedTuple):
+    """A region of a process's virtual memory, as listed in /proc/<pid>/maps."""
+    start: int
+    end: int
+    permissions: str  # e.g. 'rw-p'
+    offset: int  # the offset of the region into the mapped file, if any
+    path: str  # the mapped file, a pseudo-path like '[heap]', or blank for anonymous mappings
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+
+def read_maps(pid: int) -> List[Region]:
+    """Read the memory regions mapped by a process from /proc/<pid>/maps, in ascending order of address. Returns an
+    empty list if the process does not exist."""
+    regions = []
     try:
-        return int(check_output(['pidof', 'Freelancer.exe']))
-    except CalledProcessError:
-        return 0
+        with open(f'/proc/{pid}/maps') as f:
+            for line in f:
+                span, permissions, offset, _, _, *path = line.split(maxsplit=5)
+                start, _, end = span.partition('-')
+                regions.append(Region(int(start, 16), int(end, 16), permissions, int(offset, 16),
+                                      path[0].rstrip('\n') if path else ''))
+    except OSError:
+        pass
+    return regions
+
+
+def pidfd_open(pid: int) -> int:
+    """Obtain a file descriptor referring to a process."""
+    if hasattr(os, 'pidfd_open'):  # Python 3.9+
+        return os.pidfd_open(pid)
+    pidfd = libc.syscall(SYS_PIDFD_OPEN, pid, 0)
+    if pidfd < 0:
+        raise OSError(f'pidfd_open failed for pid {pid}')
+    return pidfd
+
+
+_locator = ProcessLocator(PROCESS_NAME)
+
+
+def get_process(pid: int = None) -> int:
+    """Return a handle to Freelancer's process. If `pid` is given, return a handle to that instance of the game, or
+    zero if it is no longer running."""
+    if pid is None:
+        return _locator.get_pid()
+    return pid if read_stat(pid)[0] is not None else 0
+
+
+def get_processes() -> List[int]:
+    """Return the pids of every running instance of Freelancer."""
+    return [pid for pid, _ in find_processes(PROCESS_NAME)]
+
+
+def add_exit_listener(function: Callable[[], None], pid: int = None):
+    """Register a function to be called as soon as Freelancer's process exits. If `pid` is given, `function` is
+    instead called once, when that instance of the game exits. This requires Linux 5.3 or later; otherwise, exit is
+    only detected by polling."""
+    if pid is None:
+        _locator.exit_listeners.append(function)
+    else:
+        start_time = read_stat(pid)[1]
+        if start_time is not None:
+            watch_exit(pid, start_time, function)
+
+
+def remove_exit_listener(function: Callable[[], None], pid: int = None):
+    """Remove a function registered with `add_exit_listener`. A function registered for a pid is only held until that
+    instance of the game exits, so cannot be removed before then."""
+    if pid is None:
+        try:
+            _locator.exit_listeners.remove(function)
+        except ValueError:
+            pass
 
 
 def read_memory(process, address: int, datatype: type, buffer_size=128):
@@ -57,3 +233,48 @@ def read_memory(process, address: int, datatype: type, buffer_size=128):
     if process_vm_read(process, local, len(local), remote, len(remote), 0):
         return buffer_as_utf16(buffer) if datatype is str else buffer[0]
     return datatype()
+
+
+def read_memory_batch(process, spans: Tuple[Tuple[int, int], ...]) -> List[Optional[bytes]]:
+    """Read many (address, size) spans of Freelancer's process memory at once. The remote side of the read is
+    scattered across one iovec per span and gathered into a single local buffer, so this costs one process_vm_readv
+    call per `IOV_MAX` spans, plus one for each span that can't be read. Returns the bytes read for each span, or None
+    for spans that could not be read. Spans at address 0 are never read."""
+    result: List[Optional[bytes]] = [None] * len(spans)
+    for remote, indices, total in _compile_iovecs(spans):
+        buffer = ctypes.create_string_buffer(total)
+        read = []  # the index in `remote` and offset in `buffer` of each span read
+        start = offset = 0  # the first span not yet attempted, and its offset in `buffer`
+        while start < len(remote):
+            local = iovec(ctypes.addressof(buffer) + offset, total - offset)
+            transferred = process_vm_read(process, ctypes.byref(local), 1, ctypes.pointer(remote[start]),
+                                          len(remote) - start, 0)
+            # a transfer stops at the first remote iovec that can't be read in full, so every span before it was read
+            # and reading resumes after it
+            transferred = max(transferred, 0)
+            while start < len(remote) and remote[start].iov_len <= transferred:
+                read.append((start, offset))
+                transferred -= remote[start].iov_len
+                offset += remote[start].iov_len
+                start += 1
+            if start < len(remote):
+                offset += remote[start].iov_len  # skip the span that failed
+                start += 1
+
+        raw = buffer.raw
+        for i, offset in read:
+            result[indices[i]] = raw[offset:offset + remote[i].iov_len]
+    return result
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_iovecs(spans: Tuple[Tuple[int, int], ...]) -> List[Tuple[ctypes.Array, Tuple[int, ...], int]]:
+    """Build the remote iovec arrays for a tuple of spans, leaving out any at address 0 and splitting the rest into
+    chunks of at most `IOV_MAX`. Returns a list of (iovec array, index of each span in `spans`, total size) triples."""
+    readable = [i for i, (address, _) in enumerate(spans) if address]
+    chunks = []
+    for i in range(0, len(readable), IOV_MAX):
+        indices = tuple(readable[i:i + IOV_MAX])
+        remote = (iovec * len(indices))(*(iovec(*spans[j]) for j in indices))
+        chunks.append((remote, indices, sum(spans[j][1] for j in indices)))
+    return chunks
@@ -0,0 +1,192 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ A memory scanner for discovering new addresses to add to `READ_ADDRESSES`, in the style of Cheat Engine: take a
+ snapshot of every writable region of the game's memory, then repeatedly narrow the candidate addresses down with
+ passes like "equals my credit balance" or "changed since the last pass" until only a few remain.
+
+ Linux only, as regions are enumerated through /proc/<pid>/maps. Requires NumPy (`pip install fl-flair[scan]`).
+"""
+import ctypes
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from . import register_address
+from .linux import IOV_MAX, Region, iovec, process_vm_read, read_maps
+
+Test = Callable[[np.ndarray, np.ndarray], np.ndarray]  # (current values, previous values) -> mask of values to keep
+SPAN_GAP = 4096  # candidates further apart than this (in bytes) are read in separate spans
+
+
+class Scan:
+    """A set of candidate addresses holding values of a given type, narrowed down by successive passes.
+
+    Until the first pass, every aligned address in the scanned regions is a candidate; these are held implicitly as a
+    copy of each region rather than as arrays of addresses, which would be several times larger. Each pass re-reads the
+    candidates' values, keeps those which satisfy its test and returns the scan, so passes can be chained:
+    `Scan(pid, 'u4').equal(100).equal(250).results()`."""
+
+    def __init__(self, pid: int, datatype: Union[str, np.dtype] = 'u4', writable_only=True):
+        """`pid`: the pid of the game's process.
+        `datatype`: the NumPy type of the values to scan for, e.g. 'u4' (like `c_uint`) or 'f4' (like `c_float`).
+        `writable_only`: whether to ignore read-only regions, which will not contain any game state."""
+        self.pid = pid
+        self.dtype = np.dtype(datatype)
+        self.addresses: Optional[np.ndarray] = None  # None until the first pass
+        self.values: Optional[np.ndarray] = None  # the value of each candidate when it was last read
+        self.regions = [r for r in read_maps(pid)
+                        if r.permissions.startswith('r') and (not writable_only or 'w' in r.permissions)]
+        self._initial: List[Tuple[Region, np.ndarray]] = [(r, a) for r in self.regions
+                                                          for a in [read_region(pid, r.start, r.size)] if a is not None]
+
+    def __len__(self):
+        """The number of candidates remaining."""
+        if self.addresses is None:
+            return sum(len(a) // self.dtype.itemsize for _, a in self._initial)
+        return len(self.addresses)
+
+    def equal(self, value) -> 'Scan':
+        """Keep candidates whose value is now `value`."""
+        return self.narrow(lambda current, _: current == value)
+
+    def in_range(self, low, high) -> 'Scan':
+        """Keep candidates whose value is now between `low` and `high`, inclusive. Useful for floats such as
+        coordinates, which are rarely known exactly."""
+        return self.narrow(lambda current, _: (current >= low) & (current <= high))
+
+    def changed(self) -> 'Scan':
+        """Keep candidates whose value has changed since the last pass."""
+        return self.narrow(lambda current, previous: current != previous)
+
+    def unchanged(self) -> 'Scan':
+        """Keep candidates whose value has not changed since the last pass."""
+        return self.narrow(lambda current, previous: current == previous)
+
+    def increased(self) -> 'Scan':
+        """Keep candidates whose value has increased since the last pass."""
+        return self.narrow(lambda current, previous: current > previous)
+
+    def decreased(self) -> 'Scan':
+        """Keep candidates whose value has decreased since the last pass."""
+        return self.narrow(lambda current, previous: current < previous)
+
+    def narrow(self, test: Test) -> 'Scan':
+        """Re-read every candidate and keep those for which `test`, a vectorised function of their current and previous
+        values returning a boolean mask, is true. Candidates which can no longer be read are discarded."""
+        if self.addresses is None:
+            self._first_pass(test)
+            return self
+
+        current, readable = self._read_candidates()
+        keep = readable & test(current, self.values)
+        self.addresses, self.values = self.addresses[keep], current[keep]
+        return self
+
+    def results(self, limit=100) -> List[Tuple[int, Union[int, float]]]:
+        """Return the address and last read value of up to `limit` candidates."""
+        if self.addresses is None:
+            raise ValueError('At least one pass is required before results are available')
+        return [(int(a), v.item()) for a, v in zip(self.addresses[:limit], self.values[:limit])]
+
+    def register(self, key: str, index=0):
+        """Register a candidate address (by default, the first) in `READ_ADDRESSES` under `key`, so it can be read with
+        `get_value` and in snapshots."""
+        register_address(key, int(self.addresses[index]), np.ctypeslib.as_ctypes_type(self.dtype))
+
+    def save(self, path: str):
+        """Save the remaining candidates to a file (conventionally with the extension .npz), so that a scan can be
+        continued later, or its results kept, with `load`."""
+        if self.addresses is None:
+            raise ValueError('At least one pass is required before a scan can be saved')
+        np.savez_compressed(path, addresses=self.addresses, values=self.values)
+
+    @classmethod
+    def load(cls, path: str, pid: int) -> 'Scan':
+        """Load candidates saved by `save`, to be narrowed further in the process with the given pid. Note that the
+        addresses will only be meaningful if the game's executable and memory layout are the same."""
+        with np.load(path) as saved:
+            scan = cls.__new__(cls)
+            scan.pid = pid
+            scan.addresses, scan.values = saved['addresses'], saved['values']
+        scan.dtype = scan.values.dtype
+        scan.regions = [r for r in read_maps(pid) if r.permissions.startswith('r')]
+        scan._initial = []
+        return scan
+
+    def _first_pass(self, test: Test):
+        """Narrow the implicit set of every aligned address in the scanned regions."""
+        itemsize = self.dtype.itemsize
+        addresses, values = [], []
+        for region, initial in self._initial:
+            current = read_region(self.pid, region.start, len(initial))
+            if current is None:
+                continue
+            count = min(len(current), len(initial)) // itemsize
+            current = current[:count * itemsize].view(self.dtype)
+            indices = np.flatnonzero(test(current, initial[:count * itemsize].view(self.dtype)))
+            addresses.append(region.start + indices.astype(np.uint64) * itemsize)
+            values.append(current[indices])
+        self.addresses = np.concatenate(addresses) if addresses else np.empty(0, np.uint64)
+        self.values = np.concatenate(values) if values else np.empty(0, self.dtype)
+        self._initial = []  # free the snapshot
+
+    def _read_candidates(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Read the current value of every candidate. Addresses are sorted, so they are grouped into spans of nearby
+        candidates, split wherever neighbours are more than `SPAN_GAP` bytes apart or in different regions, so that
+        the memory read follows the number of candidates rather than the size of the regions they are in. Spans are
+        read up to `IOV_MAX` at a time into one buffer. Returns the values and a mask of which could be read."""
+        itemsize = self.dtype.itemsize
+        addresses = self.addresses
+        if not len(addresses):
+            return np.empty(0, self.dtype), np.empty(0, bool)
+
+        region_of = np.searchsorted(np.array([r.start for r in self.regions], np.uint64), addresses, 'right')
+        breaks = np.flatnonzero((np.diff(addresses) > SPAN_GAP) | (np.diff(region_of) != 0)) + 1
+        firsts = np.concatenate(([0], breaks))  # the index of each span's first candidate
+        lasts = np.concatenate((breaks, [len(addresses)]))
+        span_starts = addresses[firsts]
+        span_sizes = addresses[lasts - 1] + itemsize - span_starts
+        span_offsets = np.concatenate(([0], np.cumsum(span_sizes)[:-1])).astype(np.intp)  # each span's place in buffer
+
+        buffer = np.empty(int(span_sizes.sum()), np.uint8)
+        span_read = read_spans(self.pid, buffer, span_starts, span_sizes, span_offsets)
+
+        span_of = np.repeat(np.arange(len(firsts)), lasts - firsts)  # the span each candidate is in
+        positions = span_offsets[span_of] + (addresses - span_starts[span_of]).astype(np.intp)
+        current = buffer[positions[:, None] + np.arange(itemsize)].view(self.dtype).ravel()
+        return current, span_read[span_of]
+
+
+def read_spans(pid: int, buffer: np.ndarray, starts: np.ndarray, sizes: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Read many (start, size) spans of a process's memory into `buffer`, each at its offset, with one
+    process_vm_readv call per `IOV_MAX` spans. A span that can't be read ends a call early, so reading resumes after
+    it. Returns a mask of which spans were read."""
+    read = np.zeros(len(starts), bool)
+    base = buffer.ctypes.data
+    i = 0
+    while i < len(starts):
+        chunk = slice(i, min(i + IOV_MAX, len(starts)))
+        count = chunk.stop - chunk.start
+        local = (iovec * count)(*(iovec(base + int(o), int(s)) for o, s in zip(offsets[chunk], sizes[chunk])))
+        remote = (iovec * count)(*(iovec(int(a), int(s)) for a, s in zip(starts[chunk], sizes[chunk])))
+        transferred = max(process_vm_read(pid, local, count, remote, count, 0), 0)
+        # transfers never split a remote iovec, so whole spans are read up to the first that failed
+        complete = int(np.searchsorted(np.cumsum(sizes[chunk]), transferred, 'right'))
+        read[i:i + complete] = True
+        i += complete + (complete < count)  # skip the span that failed
+    return read
+
+
+def read_region(pid: int, address: int, size: int) -> Optional[np.ndarray]:
+    """Read `size` bytes of a process's memory, starting at `address`, directly into a NumPy array of bytes. The array
+    is shorter than `size` if only part of the region could be read, or None if none of it could."""
+    buffer = np.empty(size, np.uint8)
+    local = iovec(buffer.ctypes.data, size)
+    remote = iovec(address, size)
+    transferred = process_vm_read(pid, ctypes.byref(local), 1, ctypes.byref(remote), 1, 0)
+    return buffer[:transferred] if transferred > 0 else None
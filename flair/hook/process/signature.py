@@ -0,0 +1,135 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ Address profiles, which locate the addresses in `READ_ADDRESSES` by searching the game's executable for the
+ instructions that use them, rather than hardcoding their offsets. This allows executables other than v1.1, like
+ those of modded clients, to be supported.
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+from typing import Dict, NamedTuple, Optional, Pattern, Tuple
+
+from ... import platforms
+from . import POINTER_SIZE, read_memory_batch, register_address, register_pointer
+
+IMAGE_BASE = 0x400000  # Freelancer.exe has no relocations, so is always loaded at its preferred base address
+CHUNK_SIZE = 0x10000  # the image is read in chunks of this size so that an unreadable page loses only its chunk
+CACHE_VERSION = 1  # increment when the format of the cache changes
+
+
+class Signature(NamedTuple):
+    """A pattern of bytes identifying an instruction which references an address, e.g. 'A1 ?? ?? ?? ?? 85 C0' for
+    `mov eax, [address]; test eax, eax`. Bytes are given in hex; `??` matches any byte. `operand` is the offset into
+    the match of the 32-bit address referenced."""
+    pattern: str
+    operand: int = 0
+
+
+class Entry(NamedTuple):
+    """How to find one address. The signature locates a static address. If `offsets` is empty, this is the address
+    itself; otherwise it is the base of a pointer chain (see `register_pointer`)."""
+    signature: Signature
+    datatype: type
+    offsets: Tuple[int, ...] = ()
+    length: Optional[int] = None  # for strings, the maximum length in characters
+
+
+Profile = Dict[str, Entry]  # maps keys in `READ_ADDRESSES` to how to find them
+
+
+def apply_profile(process: 'HANDLE', profile: Profile, executable: str) -> Dict[str, int]:
+    """Locate the addresses described by `profile` in the game's image and register them, replacing any existing
+    addresses with the same keys. `executable` is the path to the game's executable. The static addresses found are
+    cached by the executable's fingerprint, so the image need only be scanned the first time a particular executable
+    is used. Returns the static addresses found. Raises `LookupError` if a signature cannot be found."""
+    key = fingerprint(executable, profile)
+    found = read_cache(key)
+    if found is None or not found.keys() >= profile.keys():
+        found = scan_image(read_image(process), profile)
+        write_cache(key, found)
+
+    for name, entry in profile.items():
+        if entry.offsets:
+            register_pointer(name, found[name], entry.offsets, entry.datatype, entry.length)
+        else:
+            register_address(name, found[name], entry.datatype, entry.length)
+    return found
+
+
+def scan_image(image: bytes, profile: Profile) -> Dict[str, int]:
+    """Search an image of the game's executable for the signature of each entry in `profile`, returning the static
+    address referenced by the first match of each."""
+    found = {}
+    for name, entry in profile.items():
+        match = compile_pattern(entry.signature.pattern).search(image)
+        if match is None:
+            raise LookupError(f'Signature for {name!r} not found')
+        operand = match.start() + entry.signature.operand
+        found[name] = int.from_bytes(image[operand:operand + POINTER_SIZE], 'little')
+    return found
+
+
+def read_image(process: 'HANDLE') -> bytes:
+    """Read the game's executable image as mapped into its memory, using the size given in its PE header. Chunks which
+    cannot be read are filled with zeroes."""
+    header, = read_memory_batch(process, ((IMAGE_BASE, 0x400),))
+    if header is None or header[:2] != b'MZ':
+        raise LookupError('Executable image not found')
+    nt_header = int.from_bytes(header[0x3C:0x40], 'little')  # e_lfanew
+    size = int.from_bytes(header[nt_header + 0x50:nt_header + 0x54], 'little')  # OptionalHeader.SizeOfImage
+
+    spans = tuple((address, min(CHUNK_SIZE, IMAGE_BASE + size - address))
+                  for address in range(IMAGE_BASE, IMAGE_BASE + size, CHUNK_SIZE))
+    return b''.join(chunk if chunk is not None else bytes(length)
+                    for chunk, (_, length) in zip(read_memory_batch(process, spans), spans))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> Pattern[bytes]:
+    """Compile a signature's pattern to a regular expression over bytes."""
+    return re.compile(b''.join(b'.' if byte == '??' else re.escape(bytes.fromhex(byte)) for byte in pattern.split()),
+                      re.DOTALL)
+
+
+def fingerprint(executable: str, profile: Profile) -> str:
+    """Compute a key identifying an executable, by its contents, and the signatures searched for in it."""
+    digest = hashlib.sha1(str(CACHE_VERSION).encode())
+    with open(executable, 'rb') as f:
+        digest.update(f.read())
+    for name, entry in sorted(profile.items()):
+        digest.update(f'{name}:{entry.signature.pattern}:{entry.signature.operand}\n'.encode())
+    return digest.hexdigest()
+
+
+def cache_path(key: str) -> str:
+    """Return the path to the cache file for a fingerprint."""
+    return os.path.join(platforms.CACHE_DIR, f'addresses-{key[:16]}.json')
+
+
+def read_cache(key: str) -> Optional[Dict[str, int]]:
+    """Read the cached static addresses for a fingerprint, returning None if there are none."""
+    try:
+        with open(cache_path(key)) as f:
+            cached_key, found = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return found if cached_key == key else None
+
+
+def write_cache(key: str, found: Dict[str, int]):
+    """Write the static addresses found for a fingerprint to the cache. Failure to do so is not an error."""
+    path = cache_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump((key, found), f)
+        os.replace(path + '.tmp', path)  # atomically, so a partially written cache is never read
+    except OSError:
+        pass
@@ -7,23 +7,26 @@
 """
 import ctypes
 import errno
+from typing import Callable, List, Optional, Tuple
 
 from pywintypes import HANDLE
 import win32api
+import win32gui
 import win32process
 import win32con
 
-from ..window import get_hwnd
+from ..window import get_hwnd, WINDOW_TITLE
 from . import buffer_as_utf16
 
 
 PROCESS_VM_READ = 0x10  # <https://msdn.microsoft.com/en-us/library/windows/desktop/ms684880(v=vs.85).aspx>
 
 
-def get_process() -> HANDLE:
-    """Return a handle to Freelancer's process."""
-    hwnd = get_hwnd()
-    pid = win32process.GetWindowThreadProcessId(hwnd)[1]
+def get_process(pid: int = None) -> HANDLE:
+    """Return a handle to Freelancer's process. If `pid` is given, return a handle to that instance of the game."""
+    if pid is None:
+        hwnd = get_hwnd()
+        pid = win32process.GetWindowThreadProcessId(hwnd)[1]
     try:
         process = win32api.OpenProcess(win32con.PROCESS_VM_READ, 0, pid)
     except win32api.error as e:
@@ -33,6 +36,28 @@ def get_process() -> HANDLE:
     return process
 
 
+def get_processes() -> List[int]:
+    """Return the pids of every running instance of Freelancer."""
+    pids = []
+
+    def collect(hwnd, _):
+        if win32gui.GetClassName(hwnd) == WINDOW_TITLE and win32gui.GetWindowText(hwnd) == WINDOW_TITLE:
+            pids.append(win32process.GetWindowThreadProcessId(hwnd)[1])
+        return True
+
+    win32gui.EnumWindows(collect, None)
+    return pids
+
+
+def add_exit_listener(function: Callable[[], None], pid: int = None):
+    """Register a function to be called as soon as Freelancer's process exits. Exit is not pushed on Windows, so this
+    does nothing; it is detected by polling instead."""
+
+
+def remove_exit_listener(function: Callable[[], None], pid: int = None):
+    """Remove a function registered with `add_exit_listener`. As that does nothing on Windows, so does this."""
+
+
 def read_memory(process: HANDLE, address: int, datatype: type, buffer_size=128):
     """Reads Freelancer's process memory.
 
@@ -51,3 +76,18 @@ def read_memory(process: HANDLE, address: int, datatype: type, buffer_size=128):
             ctypes.memmove(ctypes.byref(value), buffer, ctypes.sizeof(value))
             value = value.value  # C type -> Python type, effectively
     return value
+
+
+def read_memory_batch(process: HANDLE, spans: Tuple[Tuple[int, int], ...]) -> List[Optional[bytes]]:
+    """Read many (address, size) spans of Freelancer's process memory. Windows has no scatter/gather equivalent to
+    process_vm_readv, so this makes one ReadProcessMemory call per span. Returns the bytes read for each span, or None
+    for spans that could not be read."""
+    handle = process if isinstance(process, int) else process.handle
+    result = []
+    for address, size in spans:
+        buffer = ctypes.create_string_buffer(size)
+        if ctypes.windll.kernel32.ReadProcessMemory(handle, address, buffer, size, 0):
+            result.append(buffer.raw)
+        else:
+            result.append(None)
+    return result
@@ -5,12 +5,12 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
-from typing import Dict
+import functools
+import os
+import threading
+from typing import Any, Callable, Dict, Tuple
 import warnings
 
-from flint.formats import ini
-from flint.paths import construct_path
-
 from ... import platforms
 
 REGISTRY_DIR = r'Software\Microsoft\Microsoft Games\Freelancer\1.0'
@@ -19,17 +19,45 @@ DEFAULT_KEY_MAP = 'DATA/INTERFACE/keymap.ini'
 CHAT_MESSAGE_MAX_LENGTH = 140
 
 
+def cached_by_file(function: Callable[[str], Any]) -> Callable[[str], Any]:
+    """Decorate a function which takes the path to a file and returns something derived from its contents, so that the
+    result is cached and the function only called again once the file has changed. Whether the file has changed is
+    determined from its modification time, size and inode, so a cache hit costs a single stat call. Cached results are
+    shared between callers and must not be modified."""
+    cache: Dict[str, Tuple[Tuple[int, int, int], Any]] = {}
+    lock = threading.Lock()
+
+    @functools.wraps(function)
+    def wrapper(path: str):
+        stat = os.stat(path)  # raises FileNotFoundError if the file does not exist, as the function would
+        version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with lock:
+            cached = cache.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        result = function(path)
+        with lock:
+            cache[path] = (version, result)
+        return result
+
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
 def get_user_keymap() -> Dict[str, str]:
     """Get the user's configured keymap."""
+    from flint.paths import construct_path  # flint is slow to import, so is imported upon first use
     try:
         return parse_keymap(USER_KEY_MAP)
     except FileNotFoundError:
         return parse_keymap(construct_path(DEFAULT_KEY_MAP))
 
 
+@cached_by_file
 def parse_keymap(keymap_file: str) -> Dict[str, str]:
     """Parse a Freelancer keymap file, like UserKeyMap.ini or keymap.ini, and convert keys to a format understood by
-    the `keyboard` module."""
+    the `keyboard` module. The result is cached until the file changes."""
+    from flint.formats import ini
     key_map = ini.sections(keymap_file, fold_values=False)['keycmd']
 
     result = {}  # maps a command nicknames to its primary key binding
@@ -6,12 +6,13 @@
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 import os.path
+from typing import Dict
 
 import virtualkeys
 
 from ... import platforms
 from .. import storage
-from . import REGISTRY_DIR
+from . import REGISTRY_DIR, cached_by_file
 
 
 USER_REGISTRY_FILE_PATH: str
@@ -20,19 +21,35 @@ USER_REGISTRY_FILE_PATH: str
 def get_active_account_name() -> str:
     """Returns the currently active account's code ("name") from the registry.
     Note that Freelancer reads the account from the registry at the time of server connect.
+
+    Rather than reading the whole registry file, which can be several megabytes, only the section for Freelancer's key
+    is read, using an index which is rebuilt only when the file changes.
     """
-    with open(USER_REGISTRY_FILE_PATH, 'r') as f:
-        wine_reg = f.read()
-    path = None
-
-    wine_reg_path = REGISTRY_DIR.replace('\\', '\\\\')
-    for line in wine_reg.splitlines():
-        if path != wine_reg_path:
-            if line.startswith('['):
-                path = line.split(']')[0][1:]
-        else:
-            if line.startswith('"MPAccountName"='):
-                return line.split('=')[1].replace('"', '')
+    offset = index_registry(USER_REGISTRY_FILE_PATH).get(REGISTRY_DIR.replace('\\', '\\\\'))
+    if offset is None:
+        return None
+
+    with open(USER_REGISTRY_FILE_PATH, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if line.startswith(b'['):  # reached the next key
+                break
+            if line.startswith(b'"MPAccountName"='):
+                return line.decode(errors='replace').rstrip('\r\n').split('=')[1].replace('"', '')
+
+
+@cached_by_file
+def index_registry(path: str) -> Dict[str, int]:
+    """Index a Wine registry file, mapping the path of each key to the offset of the line following its header. The
+    result is cached until the file changes."""
+    index = {}
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            offset += len(line)
+            if line.startswith(b'['):
+                index[line.partition(b']')[0][1:].decode(errors='replace')] = offset
+    return index
 
 
 def virtual_key_to_name(vk: int) -> str:
@@ -0,0 +1,81 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from . import process
+
+
+class MemoryWatcher:
+    """Reads a set of addresses from Freelancer's memory at high frequency, but only while a thread is waiting for
+    their values to satisfy a condition.
+
+    Waiting threads sleep on a condition variable and are woken after each read, so a condition is noticed within
+    `period` seconds of becoming true without any thread busy-waiting. While nothing is waiting, the watcher's thread
+    sleeps and no memory is read."""
+
+    def __init__(self, keys: Iterable[str] = None, period=0.004, pid: int = None):
+        """`keys`: the keys of the addresses to read (by default, all registered addresses).
+        `period`: the time (in seconds) between reads while a thread is waiting.
+        `pid`: if given, the pid of the instance of the game to read."""
+        self.keys = tuple(keys) if keys is not None else None
+        self.period = period
+        self.pid = pid
+        self._condition = threading.Condition()
+        self._waiters = 0
+        self._snapshot: Optional[process.Snapshot] = None
+        self._generation = 0  # incremented after each read
+        self._thread: Optional[threading.Thread] = None
+
+    def wait_until(self, predicate: Callable[[process.Snapshot], bool], timeout: Optional[float] = 0.1) -> bool:
+        """Block until `predicate`, called with a snapshot of the watched addresses, returns true, or `timeout` seconds
+        pass. Only snapshots read after this is called are considered. Returns whether the predicate became true."""
+        with self._condition:
+            start = self._generation
+            self._waiters += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='flair memory watcher', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+            try:
+                return self._condition.wait_for(
+                    lambda: self._generation > start and predicate(self._snapshot), timeout)
+            finally:
+                self._waiters -= 1
+
+    def _run(self):
+        """Read the watched addresses every `period` seconds while there are waiting threads. The process handle is
+        kept for as long as threads are waiting, and fetched afresh when they next begin to, so that a restarted game
+        is found without opening a handle for every read. A failed read is skipped; waiting threads time out if reads
+        keep failing, e.g. because the game has exited."""
+        handle = None
+        try:
+            while True:
+                with self._condition:
+                    if not self._waiters:
+                        handle = None
+                        self._condition.wait_for(lambda: self._waiters)
+                try:
+                    if not handle:
+                        handle = process.get_process(self.pid)
+                    snapshot = process.read_snapshot(handle, self.keys)
+                except Exception:
+                    handle = None
+                else:
+                    with self._condition:
+                        self._snapshot = snapshot
+                        self._generation += 1
+                        self._condition.notify_all()
+                time.sleep(self.period)
+        finally:
+            with self._condition:
+                self._thread = None  # so that `wait_until` starts another
+
+
+dialogue_watcher = MemoryWatcher(('enter_dialogue', 'focus_dialogue'))  # used to detect the chat box opening or closing
@@ -10,12 +10,14 @@ from ... import platforms
 WINDOW_TITLE = 'Freelancer'
 
 
-def is_present() -> bool:
-    """Reports whether Freelancer is running."""
-    return bool(get_hwnd())
+def is_present(pid: int = None) -> bool:
+    """Reports whether Freelancer (or, if `pid` is given, that instance of it) is running."""
+    return bool(get_hwnd(pid))
 
 
 if platforms.WIN32:
-    from .win32 import get_hwnd, is_foreground, make_foreground, get_screen_coordinates, make_borderless
+    from .win32 import get_hwnd, is_foreground, make_foreground, get_screen_coordinates, make_borderless, \
+        add_foreground_listener, remove_foreground_listener, capture
 elif platforms.LINUX:
-    from .linux import get_hwnd, is_foreground, make_foreground, get_screen_coordinates, make_borderless
+    from .linux import get_hwnd, is_foreground, make_foreground, get_screen_coordinates, make_borderless, \
+        add_foreground_listener, remove_foreground_listener, capture
@@ -5,41 +5,167 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
-from typing import Tuple, Union, Optional
+import threading
+import time
+from typing import Callable, Dict, List, Tuple, Union, Optional, TYPE_CHECKING
 
+from Xlib import X
 from Xlib.display import Display
-from Xlib.error import BadWindow
+from Xlib.error import BadDrawable, BadMatch, BadWindow
 from Xlib.X import RaiseLowest
 from Xlib.xobject.drawable import Window
 
 from . import WINDOW_TITLE
 
+if TYPE_CHECKING:
+    from PIL import Image
 
-def find_window(name: str, window: Window) -> Optional[Window]:
-    """Recursively locate a window with name `name` in the tree, starting at `window`."""
-    if window.get_wm_name() == name:
+NEGATIVE_CACHE_PERIOD = 1.0  # how long (in seconds) a failure to find the window is trusted before searching again
+
+
+def find_window(name: str, window: Window, matches: Callable[[Window], bool] = None) -> Optional[Window]:
+    """Recursively locate a window with name `name` in the tree, starting at `window`. If `matches` is given, the
+    window must also satisfy it."""
+    if window.get_wm_name() == name and (matches is None or matches(window)):
         return window
     children = window.query_tree().children
     for child in children:
-        val = find_window(name, child)
+        val = find_window(name, child, matches)
         if val:
             return val
 
 
-def get_hwnd() -> Union[Window, int]:
-    """Returns a non-zero window handle to Freelancer if a window exists, otherwise, returns zero."""
-    try:
-        return find_window(WINDOW_TITLE, Display().screen().root)
-    except BadWindow:
-        return 0
+class WindowTracker:
+    """Tracks Freelancer's window over a long-lived connection to the X server.
+
+    The window is located once and cached. Where a pid is given, the window of that instance of the game is located,
+    using the `_NET_WM_PID` property Wine sets. The cache is invalidated when top-level windows are created, destroyed,
+    mapped, unmapped or reparented, which a background thread learns of through events on the root window. The same
+    thread follows `_NET_ACTIVE_WINDOW`, so that whether Freelancer is in the foreground is known without a round trip
+    and changes to it can be pushed to listeners. If the window manager does not support `_NET_ACTIVE_WINDOW`, the
+    input focus is queried instead."""
+    INVALIDATING_EVENTS = {X.CreateNotify, X.DestroyNotify, X.MapNotify, X.UnmapNotify, X.ReparentNotify}
+
+    def __init__(self):
+        self.display = Display()  # used for queries
+        self.root = self.display.screen().root
+        self.lock = threading.RLock()
+        self.listeners: List[Tuple[Callable[[bool], None], Optional[int]]] = []  # each listener and its pid
+
+        self._hwnds: Dict[Optional[int], Union[Window, int]] = {}  # maps pid to window; cleared when invalidated
+        self._searched_at: Dict[Optional[int], float] = {}
+        self._net_active_window = self.display.intern_atom('_NET_ACTIVE_WINDOW')
+        self._net_wm_pid = self.display.intern_atom('_NET_WM_PID')
+        self._ewmh = self.root.get_full_property(self._net_active_window, X.AnyPropertyType) is not None
+        self._active_window = self._read_active_window()
+        self._foreground: Dict[Optional[int], bool] = {}  # the last foreground state pushed to listeners, by pid
+
+        # a thread blocked waiting for events can't safely share a connection, so it is given its own
+        self._events = Display()
+        self._events.screen().root.change_attributes(event_mask=X.SubstructureNotifyMask | X.PropertyChangeMask)
+        self._events.flush()
+        threading.Thread(target=self._watch, name='flair window tracker', daemon=True).start()
+
+    def get_hwnd(self, pid: int = None) -> Union[Window, int]:
+        """Return the cached window handle, searching for the window first if the cache has been invalidated."""
+        with self.lock:
+            hwnd = self._hwnds.get(pid)
+            if hwnd is None or (not hwnd and time.monotonic() - self._searched_at[pid] > NEGATIVE_CACHE_PERIOD):
+                matches = None if pid is None else (lambda w: self._window_pid(w) == pid)
+                try:
+                    hwnd = find_window(WINDOW_TITLE, self.root, matches) or 0
+                except BadWindow:  # a window was destroyed during the search
+                    hwnd = 0
+                self._hwnds[pid] = hwnd
+                self._searched_at[pid] = time.monotonic()
+            return hwnd
+
+    def is_foreground(self, pid: int = None) -> bool:
+        """Reports whether Freelancer is in the foreground and accepting input."""
+        with self.lock:
+            if not self._ewmh:
+                try:
+                    focus = self.display.get_input_focus().focus
+                    return focus.get_wm_name() == WINDOW_TITLE and (pid is None or self._window_pid(focus) == pid)
+                except (TypeError, AttributeError, BadWindow):
+                    return False
+            hwnd = self.get_hwnd(pid)
+            return bool(hwnd) and hwnd.id == self._active_window
+
+    def _window_pid(self, window: Window) -> Optional[int]:
+        """Read the pid of the process owning a window from its `_NET_WM_PID` property, if set."""
+        wm_pid = window.get_full_property(self._net_wm_pid, X.AnyPropertyType)
+        return wm_pid.value[0] if wm_pid and len(wm_pid.value) else None
+
+    def _read_active_window(self) -> int:
+        """Read the ID of the active window from the root window's `_NET_ACTIVE_WINDOW` property."""
+        active = self.root.get_full_property(self._net_active_window, X.AnyPropertyType)
+        return active.value[0] if active and len(active.value) else 0
+
+    def _watch(self):
+        """Process events from the X server for as long as the program runs."""
+        while True:
+            event = self._events.next_event()
+            with self.lock:
+                if event.type in self.INVALIDATING_EVENTS:
+                    self._hwnds.clear()
+                    continue
+                if not (event.type == X.PropertyNotify and event.atom == self._net_active_window):
+                    continue
+                self._active_window = self._read_active_window()
+                changes = []
+                for listener, pid in self.listeners:
+                    foreground = self.is_foreground(pid)
+                    if foreground != self._foreground.get(pid):
+                        changes.append((listener, foreground))
+                for _, pid in self.listeners:
+                    self._foreground[pid] = self.is_foreground(pid)
+            for listener, foreground in changes:
+                listener(foreground)
+
+
+_tracker: Optional[WindowTracker] = None
+_tracker_lock = threading.Lock()
+_capture_display: Optional[Display] = None
+_capture_lock = threading.Lock()
 
 
-def is_foreground() -> bool:
-    """Reports whether Freelancer is in the foreground and accepting input."""
-    try:
-        return Display().get_input_focus().focus.get_wm_name() == WINDOW_TITLE
-    except (TypeError, AttributeError):
-        return False
+def get_tracker() -> WindowTracker:
+    """Return the window tracker, creating it upon first use."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = WindowTracker()
+        return _tracker
+
+
+def get_hwnd(pid: int = None) -> Union[Window, int]:
+    """Returns a non-zero window handle to Freelancer if a window exists, otherwise, returns zero. If `pid` is given,
+    returns the window belonging to that instance of the game."""
+    return get_tracker().get_hwnd(pid)
+
+
+def is_foreground(pid: int = None) -> bool:
+    """Reports whether Freelancer (or, if `pid` is given, that instance of it) is in the foreground and accepting
+    input."""
+    return get_tracker().is_foreground(pid)
+
+
+def add_foreground_listener(function: Callable[[bool], None], pid: int = None):
+    """Register a function to be called, with whether Freelancer (or, if `pid` is given, that instance of it) is now in
+    the foreground, when this changes."""
+    tracker = get_tracker()
+    with tracker.lock:
+        tracker.listeners.append((function, pid))
+
+
+def remove_foreground_listener(function: Callable[[bool], None], pid: int = None):
+    """Remove a function registered with `add_foreground_listener`."""
+    tracker = get_tracker()
+    with tracker.lock:
+        tracker.listeners = [(f, p) for f, p in tracker.listeners if not (f == function and p == pid)]
+        if all(p != pid for _, p in tracker.listeners):
+            tracker._foreground.pop(pid, None)
 
 
 def make_foreground():
@@ -59,6 +185,27 @@ def get_screen_coordinates() -> Tuple[int, int, int, int]:
     return left_x, top_y, right_x, bottom_y
 
 
+def capture() -> Optional['Image.Image']:
+    """Capture the contents of Freelancer's window as an image. Only the window's own pixels are transferred from the
+    X server (with XGetImage), rather than the whole screen. Returns None if there is no window to capture."""
+    from PIL import Image  # imported here as Pillow is only needed for screenshots
+
+    global _capture_display
+    hwnd = get_hwnd()
+    if not hwnd:
+        return None
+    with _capture_lock:
+        if _capture_display is None:
+            _capture_display = Display()  # a connection of our own, as Xlib connections are not thread-safe
+        window = _capture_display.create_resource_object('window', hwnd.id)
+        try:
+            geometry = window.get_geometry()
+            image = window.get_image(0, 0, geometry.width, geometry.height, X.ZPixmap, 0xFFFFFFFF)
+        except (BadDrawable, BadMatch, BadWindow):  # the window was closed or unmapped
+            return None
+    return Image.frombytes('RGB', (geometry.width, geometry.height), image.data, 'raw', 'BGRX')
+
+
 def make_borderless():
     """Remove the borders and titlebar from the game running in windowed mode."""
     raise NotImplementedError
@@ -5,22 +5,52 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
-from typing import Tuple
+from typing import Callable, Optional, Tuple, TYPE_CHECKING
 
 import win32con
 import win32gui
+import win32process
 
 from . import WINDOW_TITLE
 
+if TYPE_CHECKING:
+    from PIL import Image
 
-def get_hwnd() -> int:
-    """Returns a non-zero window handle to Freelancer if a window exists, otherwise, returns zero."""
-    return win32gui.FindWindow(WINDOW_TITLE, WINDOW_TITLE)
 
+def get_hwnd(pid: int = None) -> int:
+    """Returns a non-zero window handle to Freelancer if a window exists, otherwise, returns zero. If `pid` is given,
+    returns the window belonging to that instance of the game."""
+    if pid is None:
+        return win32gui.FindWindow(WINDOW_TITLE, WINDOW_TITLE)
+    found = []
 
-def is_foreground() -> bool:
-    """Reports whether Freelancer is in the foreground and accepting input."""
-    return win32gui.GetForegroundWindow() == get_hwnd()
+    def match(hwnd, _):
+        if win32gui.GetClassName(hwnd) == WINDOW_TITLE and win32process.GetWindowThreadProcessId(hwnd)[1] == pid:
+            found.append(hwnd)
+            return False  # stop enumerating
+        return True
+
+    try:
+        win32gui.EnumWindows(match, None)
+    except win32gui.error:
+        pass  # raised when enumeration is stopped early
+    return found[0] if found else 0
+
+
+def is_foreground(pid: int = None) -> bool:
+    """Reports whether Freelancer (or, if `pid` is given, that instance of it) is in the foreground and accepting
+    input."""
+    return win32gui.GetForegroundWindow() == get_hwnd(pid)
+
+
+def add_foreground_listener(function: Callable[[bool], None], pid: int = None):
+    """Register a function to be called, with whether Freelancer (or, if `pid` is given, that instance of it) is now in
+    the foreground, when this changes. Foreground changes are not pushed on Windows, so this does nothing; they are
+    detected by polling instead."""
+
+
+def remove_foreground_listener(function: Callable[[bool], None], pid: int = None):
+    """Remove a function registered with `add_foreground_listener`. As that does nothing on Windows, so does this."""
 
 
 def make_foreground():
@@ -39,6 +69,18 @@ def get_screen_coordinates() -> Tuple[int, int, int, int]:
     return left_x, top_y, right_x, bottom_y
 
 
+def capture() -> Optional['Image.Image']:
+    """Capture the contents of Freelancer's window as an image. Only the window's region of the screen is copied.
+    Returns None if there is no window to capture."""
+    from PIL import ImageGrab  # imported here as Pillow is only needed for screenshots
+    if not get_hwnd():
+        return None
+    try:
+        return ImageGrab.grab(get_screen_coordinates())
+    except win32gui.error:  # the window was closed
+        return None
+
+
 def make_borderless():
     """Remove the borders and titlebar from the game running in windowed mode.
     Todo: Windowed mode seems to cut off the bottom of the game. This is something that will need worked around."""
@@ -5,36 +5,216 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+import weakref
 
+OVERFLOW_POLICIES = ('drop-oldest', 'block', 'coalesce')
 
-class Signal(set):
-    """A simple event object inspired by Qt's signals and slots mechanism."""
+
+class Event(NamedTuple):
+    """A single emission of a signal, as yielded by `stream`."""
+    signal: str  # the name of the signal emitted
+    payload: Dict[str, Any]
+
+
+class QueuedSubscriber:
+    """A function connected to a signal in queued mode. Emissions are placed in a bounded queue, from which the
+    function is called in order on a shared thread pool, so a slow function can't hold up the thread emitting the
+    signal or any other subscriber.
+
+    When the queue is full, `overflow` decides what happens to a new emission:
+     - 'drop-oldest': the oldest queued emission is discarded to make room
+     - 'block': the emitting thread waits until there is room
+     - 'coalesce': the newest queued emission is replaced, so the function sees only the latest payload
+    """
+
+    def __init__(self, function: Callable, maxsize=64, overflow='drop-oldest'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Overflow policy must be one of {OVERFLOW_POLICIES}')
+        self.function = function
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0  # the number of emissions discarded or replaced due to overflow
+        self.handled = 0  # the number of emissions the function has been called with
+        self.total_latency = 0.0  # the total time (in seconds) spent in the function
+        self.max_latency = 0.0  # the longest time (in seconds) spent in one call to the function
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._draining = False  # whether a task to drain the queue has been submitted to the pool
+
+    def __call__(self, **payload):
+        """Queue an emission to be handled."""
+        with self._condition:
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == 'block':
+                    while len(self._queue) >= self.maxsize:
+                        self._condition.wait()
+                elif self.overflow == 'drop-oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._queue.pop()
+                    self.dropped += 1
+            self._queue.append(payload)
+            if not self._draining:
+                self._draining = True
+                get_executor().submit(self._drain)
+
+    def __eq__(self, other):
+        """Compare equal to the wrapped function, so that it can be disconnected as usual."""
+        return self.function == (other.function if isinstance(other, QueuedSubscriber) else other)
+
+    def __hash__(self):
+        return hash(self.function)
+
+    @property
+    def metrics(self) -> Dict[str, float]:
+        """Statistics on this subscriber's queue and the time taken to handle emissions."""
+        return {
+            'depth': len(self._queue),
+            'dropped': self.dropped,
+            'handled': self.handled,
+            'mean_latency': self.total_latency / self.handled if self.handled else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+    def _drain(self):
+        """Call the function with each queued emission in turn until the queue is empty."""
+        while True:
+            with self._condition:
+                if not self._queue:
+                    self._draining = False
+                    return
+                payload = self._queue.popleft()
+                self._condition.notify_all()
+
+            start = time.perf_counter()
+            try:
+                self.function(**payload)
+            except Exception:
+                traceback.print_exc()  # one failing emission must not stop the rest being handled
+            latency = time.perf_counter() - start
+            self.handled += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the thread pool queued subscribers are run on, creating it upon first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix='flair signal')
+        return _executor
+
+
+class WeakSubscriber:
+    """A function connected to a signal by weak reference, so that being connected does not keep it (or, for a bound
+    method, its object) alive. Once it has been garbage collected, `on_dead` is called so it can be disconnected."""
+
+    def __init__(self, function: Callable):
+        self.on_dead: Callable[[], None] = lambda: None
+        reference = weakref.WeakMethod if hasattr(function, '__self__') else weakref.ref
+        self.ref = reference(function, lambda _: self.on_dead())
+        self._hash = hash(function)  # the function's hash must remain available after it has been collected
+
+    def __call__(self, **payload):
+        function = self.ref()
+        if function is not None:
+            function(**payload)
+
+    def __eq__(self, other):
+        """Compare equal to the referenced function, so that it can be disconnected as usual."""
+        function = self.ref()
+        return function is not None and function == (other.ref() if isinstance(other, WeakSubscriber) else other)
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f'WeakSubscriber({self.ref()!r})'
+
+
+class Signal:
+    """A simple event object inspired by Qt's signals and slots mechanism.
+
+    Connected functions are held in a tuple which is never mutated; connecting or disconnecting replaces it as a
+    whole. This means a signal can be emitted while functions are being connected or disconnected on another thread.
+    The payload is checked against the schema only when Python is not run with optimisations (-O)."""
 
     def __init__(self, **schema):
         """`schema` is a description of the data this signal is intended to send to connected functions when emitted."""
-        super().__init__()
         self.schema = schema
+        self.name = ''  # set below for the signals defined in this module
+        self._keys = frozenset(schema)  # precomputed so that emit needn't build sets to check payloads
+        self._handlers: Tuple[Callable, ...] = ()
+        self._lock = threading.Lock()  # serialises changes to _handlers; emitting doesn't need it
+
+    def __iter__(self) -> Iterator[Callable]:
+        return iter(self._handlers)
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def __contains__(self, function) -> bool:
+        return function in self._handlers
 
-    def connect(self, function):
-        """Connect this signal to a function. This means that it will be called when the signal is emitted."""
-        self.add(function)
+    def connect(self, function, queued=False, maxsize=64, overflow='drop-oldest', weak=False):
+        """Connect this signal to a function. This means that it will be called when the signal is emitted.
+
+        By default, the function is called synchronously by the thread emitting the signal. If `queued` is true, it is
+        instead called on a thread pool with emissions held in a queue of up to `maxsize` emissions; see
+        `QueuedSubscriber` for this and for the meaning of `overflow`. If `weak` is true, only a weak reference to the
+        function is kept, and it is disconnected automatically once garbage collected. Returns the function as
+        connected."""
+        handler = function
+        if weak:
+            handler = reference = WeakSubscriber(function)
+        if queued:
+            handler = QueuedSubscriber(handler, maxsize, overflow)
+        if weak:
+            reference.on_dead = lambda: self._remove(handler)
+        with self._lock:  # replace any existing connection to the function
+            self._handlers = tuple(h for h in self._handlers if not h == function) + (handler,)
+        return handler
 
     def disconnect(self, function):
         """Disconnect this signal from a function."""
-        if function in self:
-            self.remove(function)
+        with self._lock:
+            self._handlers = tuple(h for h in self._handlers if not h == function)
 
     def disconnect_all(self):
         """Disconnect all functions from this signal."""
-        self.clear()
+        with self._lock:
+            self._handlers = ()
+
+    def queue_metrics(self) -> Dict[str, Dict[str, float]]:
+        """Return the metrics of each function connected in queued mode, by name."""
+        return {getattr(s.function, '__qualname__', repr(s.function)): s.metrics
+                for s in self._handlers if isinstance(s, QueuedSubscriber)}
 
     def emit(self, **payload):
         """Emit this signal, causing all connected functions to be executed with `payload` sent as keyword arguments."""
-        if not set(payload) == set(self.schema):  # compare keys
+        if __debug__ and payload.keys() != self._keys:  # compare keys
             raise ValueError('Payload does not conform to the schema specified for this signal')
-        for function in self:
+        for function in self._handlers:
             function(**payload)
 
+    def _remove(self, handler):
+        """Disconnect a specific handler, as returned by `connect`."""
+        with self._lock:
+            self._handlers = tuple(h for h in self._handlers if h is not handler)
+
 
 # /Name/                                     # /Emitted when/                           # /Parameter(s)/
 character_changed = Signal(name=str)         # New character loaded                     # New character name
@@ -50,3 +230,109 @@ freelancer_started = Signal()                # Freelancer process launched
 freelancer_stopped = Signal()                # Freelancer process closed                # N/A
 switched_to_foreground = Signal()            # Freelancer switched to foreground        # N/A
 switched_to_background = Signal()            # Freelancer switched to background        # N/A
+text_sampled = Signal(region=str, text=str, time=float)  # New text seen by a StringSampler   # Region, text, timestamp
+
+SIGNALS = {n: s for n, s in globals().items() if isinstance(s, Signal)}  # every signal above, by name
+for _name, _signal in SIGNALS.items():
+    _signal.name = _name
+
+
+class Namespace:
+    """A copy of every signal above, for events concerning a single instance of the game; `FreelancerState.events` is
+    one. Each signal in a namespace calls its own connected functions and then emits the module-level signal of the
+    same name, so functions connected to the latter receive events from every instance."""
+
+    def __init__(self):
+        for name, signal in SIGNALS.items():
+            local = Signal(**signal.schema)
+            local.name = name
+            local.connect(_forwarder(signal))
+            setattr(self, name, local)
+
+    def __iter__(self) -> Iterator[Signal]:
+        return iter(vars(self).values())
+
+
+def _forwarder(signal: Signal) -> Callable:
+    """Build a function which emits `signal` with the payload it is called with. `emit` is looked up on each call, so
+    that instrumentation replacing it (see `flair.inspect.metrics`) still sees forwarded emissions."""
+    def forward(**payload):
+        signal.emit(**payload)
+    return forward
+
+
+class EventStream:
+    """An asynchronous iterator over the emissions of a set of signals, as returned by `stream`. Its functions are
+    connected to the signals as soon as it is created, so no emission made after that is missed, and disconnected by
+    `close`, upon leaving an `async with` block, or once it is garbage collected.
+
+    Emissions are queued in the event loop until consumed. If `maxsize` is given, only that many are kept: when the
+    queue is full, the oldest is dropped to make room (as for `QueuedSubscriber`'s 'drop-oldest' policy) and counted
+    in `dropped`."""
+
+    def __init__(self, signals: Tuple[Signal, ...], maxsize=0):
+        """Must be called in a coroutine, as emissions are queued in the running event loop."""
+        self._connections = []
+        self._inbox = _Inbox(asyncio.get_running_loop(), asyncio.Queue(maxsize))
+        for signal in signals:
+            handler = self._inbox.handler(signal.name)
+            signal.connect(handler)
+            self._connections.append((signal, handler))
+
+    @property
+    def dropped(self) -> int:
+        """The number of emissions discarded because the queue was full."""
+        return self._inbox.dropped
+
+    def close(self):
+        """Disconnect from the signals. Emissions already queued can still be consumed."""
+        for signal, handler in self._connections:
+            signal.disconnect(handler)
+        self._connections.clear()
+
+    def __aiter__(self) -> 'EventStream':
+        return self
+
+    async def __anext__(self) -> Event:
+        return await self._inbox.queue.get()
+
+    async def __aenter__(self) -> 'EventStream':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class _Inbox:
+    """The queue an `EventStream` is fed from. Kept separate from the stream so that the functions connected to signals
+    don't keep the stream alive."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self.loop = loop
+        self.queue = queue
+        self.dropped = 0
+
+    def handler(self, name: str) -> Callable:
+        """Build a function which passes emissions of the signal named `name` to the event loop to be queued."""
+        def handler(**payload):
+            self.loop.call_soon_threadsafe(self.put, Event(name, payload))
+        return handler
+
+    def put(self, event: Event):
+        """Queue an event. Called in the event loop."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+def stream(*signals: Signal, maxsize=0) -> EventStream:
+    """Asynchronously iterate over the emissions of `signals` (by default, every signal), e.g.
+    `async for event in flair.events.stream(events.credits_changed): ...`. Signals may be emitted from any thread;
+    each emission is passed to the event loop and queued, up to `maxsize` emissions if given, until it is consumed.
+    Emissions are collected from when this is called, not from when iteration begins, so it must be called in a
+    coroutine running in the loop the stream will be consumed from. See `EventStream`."""
+    return EventStream(signals or tuple(SIGNALS.values()), maxsize)
@@ -0,0 +1,271 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ Instrumentation of the poll loop: how long each state variable takes to read, how late and how long each scheduler
+ task runs, how often each signal is emitted and how long its handlers take, and how many memory-read syscalls each
+ task run makes. Metrics are available through `collect()`, or in the Prometheus/OpenMetrics text format through
+ `render()` and an optional local HTTP endpoint started by `serve()`.
+
+ Instrumentation is installed by `enable()` by wrapping the functions concerned, and removed by `disable()`, so while
+ disabled it costs nothing.
+"""
+import bisect
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import socketserver
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .. import platforms
+from ..hook import process
+from . import events
+from .scheduler import scheduler, Task
+
+LATENCY_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0, 5.0)  # upper bounds, in seconds
+SYSCALL_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+IOV_MAX = 1024  # on Linux, the number of spans read per process_vm_readv call
+
+
+class Histogram:
+    """A cumulative histogram of observed values, in the style of Prometheus."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Record a value."""
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """Return (upper bound, number of values less than or equal to it) for each bucket, ending with +Inf."""
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def summary(self) -> Dict[str, float]:
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else 0.0}
+
+
+class Metrics:
+    """The metrics collected while instrumentation is enabled."""
+
+    def __init__(self):
+        self.variable_latency: Dict[str, Histogram] = {}  # by state variable
+        self.task_lateness: Dict[str, Histogram] = {}  # how late each scheduler task started, i.e. its jitter
+        self.task_duration: Dict[str, Histogram] = {}
+        self.task_overruns: Dict[str, int] = {}  # the number of deadlines each task's runs caused to be skipped
+        self.task_syscalls: Dict[str, Histogram] = {}  # memory-read syscalls per run of each task
+        self.signal_emits: Dict[str, int] = {}
+        self.handler_duration: Dict[str, Histogram] = {}  # by signal
+        self.syscalls = 0  # memory-read syscalls made in total
+
+    @staticmethod
+    def _histogram(histograms: Dict[str, Histogram], name: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms.setdefault(name, Histogram(buckets))
+        return histogram
+
+
+metrics = Metrics()
+_enabled = False
+_originals: List[Tuple[object, str, object]] = []  # (object, attribute, original value) for each wrapped function
+_syscalls = threading.local()  # memory-read syscalls made by the current thread since its last task run
+
+
+def enable():
+    """Begin collecting metrics. Has no effect if already enabled."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    _wrap(process, 'read_memory', _counting(process.read_memory, lambda *args, **kwargs: 1))
+    _wrap(process, 'read_memory_batch', _counting(process.read_memory_batch, _batch_syscalls))
+    for name, signal in events.SIGNALS.items():
+        _wrap(signal, 'emit', _timed_emit(name, signal))
+    _instrument_state_variables()
+    scheduler.observer = _observe_task
+
+
+def disable():
+    """Stop collecting metrics and remove all instrumentation. Metrics already collected are kept."""
+    global _enabled
+    scheduler.observer = None
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        if isinstance(owner, events.Signal):
+            del owner.emit  # reveal the method again
+        else:
+            setattr(owner, attribute, original)
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Discard all metrics collected so far."""
+    global metrics
+    metrics = Metrics()
+
+
+def collect() -> Dict[str, Dict]:
+    """Return a summary of the metrics collected so far."""
+    def summarise(histograms: Dict[str, Histogram]) -> Dict[str, Dict[str, float]]:
+        return {name: h.summary() for name, h in histograms.items()}
+
+    return {
+        'variable_latency': summarise(metrics.variable_latency),
+        'task_lateness': summarise(metrics.task_lateness),
+        'task_duration': summarise(metrics.task_duration),
+        'task_overruns': dict(metrics.task_overruns),
+        'task_syscalls': summarise(metrics.task_syscalls),
+        'signal_emits': dict(metrics.signal_emits),
+        'handler_duration': summarise(metrics.handler_duration),
+        'syscalls': metrics.syscalls,
+    }
+
+
+def render() -> str:
+    """Render the metrics collected so far in the OpenMetrics text format."""
+    lines = []
+
+    def family(name: str, kind: str, description: str):
+        lines.append(f'# TYPE flair_{name} {kind}')
+        lines.append(f'# HELP flair_{name} {description}')
+
+    def histograms(name: str, label: str, values: Dict[str, Histogram], description: str):
+        family(name, 'histogram', description)
+        for key, histogram in sorted(values.items()):
+            for bound, count in histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'flair_{name}_bucket{{{label}="{key}",le="{le}"}} {count}')
+            lines.append(f'flair_{name}_count{{{label}="{key}"}} {histogram.count}')
+            lines.append(f'flair_{name}_sum{{{label}="{key}"}} {histogram.sum}')
+
+    def counters(name: str, label: str, values: Dict[str, int], description: str):
+        family(name, 'counter', description)
+        for key, value in sorted(values.items()):
+            lines.append(f'flair_{name}_total{{{label}="{key}"}} {value}')
+
+    histograms('variable_read_seconds', 'variable', metrics.variable_latency, 'Time taken to read a state variable.')
+    histograms('task_lateness_seconds', 'task', metrics.task_lateness, 'How late a scheduler task started.')
+    histograms('task_duration_seconds', 'task', metrics.task_duration, 'Time taken by a scheduler task.')
+    counters('task_overruns', 'task', metrics.task_overruns, 'Deadlines skipped because a task overran.')
+    histograms('task_syscalls', 'task', metrics.task_syscalls, 'Memory-read syscalls made by a run of a task.')
+    counters('signal_emits', 'signal', metrics.signal_emits, 'Times a signal was emitted.')
+    histograms('handler_duration_seconds', 'signal', metrics.handler_duration, 'Time taken by a signal handler.')
+    family('syscalls', 'counter', 'Memory-read syscalls made.')
+    lines.append(f'flair_syscalls_total {metrics.syscalls}')
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def serve(port=9464, host='127.0.0.1') -> HTTPServer:
+    """Serve the metrics in the OpenMetrics text format at http://host:port/metrics, on a background thread. Returns
+    the server, which can be stopped with its `shutdown` method. By default the endpoint is only reachable locally."""
+    class Server(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='flair metrics server', daemon=True).start()
+    return server
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # don't log every scrape to stderr
+
+
+def _wrap(owner, attribute: str, wrapper):
+    """Replace a function with a wrapper, remembering the original so it can be restored by `disable`."""
+    _originals.append((owner, attribute, getattr(owner, attribute)))
+    setattr(owner, attribute, wrapper)
+
+
+def _counting(function: Callable, syscalls: Callable[..., int]) -> Callable:
+    """Wrap a memory-reading function so that the syscalls it makes are counted."""
+    def wrapper(*args, **kwargs):
+        count = syscalls(*args, **kwargs)
+        metrics.syscalls += count
+        _syscalls.count = getattr(_syscalls, 'count', 0) + count
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def _batch_syscalls(process_, spans, *args, **kwargs) -> int:
+    """The number of syscalls `read_memory_batch` makes to read `spans` if every span can be read."""
+    readable = sum(1 for address, _ in spans if address)
+    return -(-readable // IOV_MAX) if platforms.LINUX else len(spans)
+
+
+def _timed_emit(name: str, signal: events.Signal) -> Callable:
+    """Build a replacement for a signal's `emit` which counts emissions and times each handler."""
+    def emit(**payload):
+        if __debug__ and payload.keys() != signal._keys:
+            raise ValueError('Payload does not conform to the schema specified for this signal')
+        metrics.signal_emits[name] = metrics.signal_emits.get(name, 0) + 1
+        histogram = Metrics._histogram(metrics.handler_duration, name)
+        for function in signal._handlers:
+            start = time.perf_counter()
+            function(**payload)
+            histogram.observe(time.perf_counter() - start)
+    return emit
+
+
+def _instrument_state_variables():
+    """Wrap the getter of every state variable so that the time taken to read it is recorded."""
+    from .state import FreelancerState, state_variable  # imported here as state has heavy dependencies
+
+    for name, variable in vars(FreelancerState).items():
+        if isinstance(variable, state_variable) and not variable.passive:
+            _wrap(variable, 'fget', _timed_getter(name, variable.fget))
+
+
+def _timed_getter(name: str, getter: Callable) -> Callable:
+    def wrapper(instance):
+        start = time.perf_counter()
+        try:
+            return getter(instance)
+        finally:
+            Metrics._histogram(metrics.variable_latency, name).observe(time.perf_counter() - start)
+    return wrapper
+
+
+def _observe_task(task: Task, lateness: float, duration: float, skipped: int):
+    """Record a run of a scheduler task."""
+    name = task.name
+    Metrics._histogram(metrics.task_lateness, name).observe(max(0.0, lateness))
+    Metrics._histogram(metrics.task_duration, name).observe(duration)
+    if skipped:
+        metrics.task_overruns[name] = metrics.task_overruns.get(name, 0) + skipped
+    Metrics._histogram(metrics.task_syscalls, name, SYSCALL_BUCKETS).observe(getattr(_syscalls, 'count', 0))
+    _syscalls.count = 0
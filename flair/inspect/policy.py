@@ -0,0 +1,43 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+ Polling policies decide how often FreelancerState polls the game, given its current state.
+"""
+from typing import FrozenSet
+
+
+class PollingPolicy:
+    """The base class for a polling policy. This policy always polls at the requested period. To create a new policy,
+    subclass this and override `period`.
+
+    Variables named in `full_rate` are exempt from the policy: they are polled in tasks of their own, always at their
+    requested period. This is for the variables whose changes should cause the policy to be consulted again."""
+    full_rate: FrozenSet[str] = frozenset()
+
+    def period(self, state: 'State', period: float) -> float:
+        """Return the period (in seconds) at which variables that would normally be polled every `period` seconds
+        should be polled, given the game's current `state`."""
+        return period
+
+
+class AdaptivePolicy(PollingPolicy):
+    """Polls at the requested period only while the game is running, in the foreground and the player is in space (or
+    has no character loaded). Otherwise, polling drops to a slow heartbeat.
+
+    `foreground`, `character_loaded` and `docked` are always polled at full rate, so polling returns to full rate
+    within one period of the game being switched to or the player undocking. (On Linux, switching to the game is
+    pushed, so is noticed immediately.) Each poll of these is a single batched read of the game's memory."""
+    full_rate = frozenset({'foreground', 'character_loaded', 'docked'})
+
+    def __init__(self, heartbeat=5.0):
+        """`heartbeat`: the period (in seconds) to poll at while the game is idle."""
+        self.heartbeat = heartbeat
+
+    def period(self, state: 'State', period: float) -> float:
+        if not state.running or not state.foreground or state.docked:
+            return max(period, self.heartbeat)
+        return period
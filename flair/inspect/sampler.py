@@ -0,0 +1,118 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+import collections
+import threading
+import time
+import traceback
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional
+
+from ..hook import process
+from . import events
+
+
+class Sample(NamedTuple):
+    """A piece of text seen in one of the game's text buffers."""
+    time: float  # when the text was first seen, as a Unix timestamp
+    region: str  # the key of the address it was read from
+    text: str
+
+
+class StringSampler:
+    """Samples the game's transient text buffers at high frequency.
+
+    Buffers like `mouseover` cycle through text that is only displayed briefly - console output, commodity prices,
+    mission popups, the names of NPCs - and most of it is missed when they are read once per poll. The sampler reads
+    them every `period` seconds on a thread of its own, so that it and the scheduler's polling can't delay each other.
+    Each buffer's raw bytes are compared with the last read and only decoded if they differ, so a tick where nothing
+    has changed costs one batched read and a few comparisons. The process handle is kept until the game's exit is
+    pushed or every read fails.
+
+    Each new piece of text is emitted through the `text_sampled` signal and kept in `history`, a ring buffer of the
+    last `history_size` samples. Consecutive repeats of the same text in a region, and empty text, are ignored."""
+    REGIONS = ('mouseover', 'rollover', 'last_message')
+
+    def __init__(self, regions: Iterable[str] = REGIONS, period=0.02, history_size=256, pid: int = None):
+        """`regions`: the keys of the string addresses to sample.
+        `period`: the time (in seconds) between samples.
+        `history_size`: the number of samples to keep in `history`.
+        `pid`: if given, the pid of the instance of the game to sample."""
+        self.regions = tuple(regions)
+        self.period = period
+        self.pid = pid
+        self.history: Deque[Sample] = collections.deque(maxlen=history_size)
+        self._raw: Dict[str, bytes] = {}  # the bytes last read from each region
+        self._text: Dict[str, str] = {}  # the text last decoded from each region
+        self._handle = None
+        self._listening = False  # whether a listener for any exit has been registered (only needed once)
+        self._stopped: Optional[threading.Event] = None
+
+    def start(self):
+        """Begin sampling. Has no effect if the sampler is already running."""
+        if self._stopped is None:
+            self._stopped = threading.Event()
+            threading.Thread(target=self._run, args=(self._stopped,), name='flair string sampler', daemon=True).start()
+
+    def stop(self):
+        """Stop sampling. The history is kept."""
+        if self._stopped is not None:
+            self._stopped.set()
+            self._stopped = None
+
+    def _run(self, stopped: threading.Event):
+        """Sample every `period` seconds until `stopped` is set. Deadlines missed because a sample overran are
+        skipped rather than made up."""
+        deadline = time.monotonic()
+        while not stopped.is_set():
+            try:
+                self.sample()
+            except Exception:
+                traceback.print_exc()  # one failed sample must not stop sampling
+            now = time.monotonic()
+            deadline += self.period
+            if deadline < now:
+                deadline = now
+            stopped.wait(deadline - now)
+
+    def sample(self):
+        """Read each region once, recording and emitting any new text."""
+        handle = self._get_handle()
+        if not handle:
+            return
+        now = time.time()
+        raws = process.read_raw(handle, self.regions)
+        if all(raw is None for raw in raws.values()):
+            self._handle = None  # the game may have exited without this being pushed
+            return
+        for region, raw in raws.items():
+            if raw is None or raw == self._raw.get(region):
+                continue
+            self._raw[region] = raw
+            text = process.bytes_as_utf16(raw)
+            if not text or text == self._text.get(region):  # only bytes after the terminator changed, or cleared
+                continue
+            self._text[region] = text
+            self.history.append(Sample(now, region, text))
+            events.text_sampled.emit(region=region, text=text, time=now)
+
+    def _get_handle(self):
+        """Return the handle to the game's process, fetching it if there is none cached."""
+        if not self._handle:
+            self._handle = process.get_process(self.pid)
+            if self._handle and not (self.pid is None and self._listening):
+                # listeners for a pid are called once, when it exits; those for no pid, upon any exit
+                process.add_exit_listener(self._invalidate, self.pid)
+                self._listening = True
+        return self._handle
+
+    def _invalidate(self):
+        """Discard the cached process handle, as the game has exited."""
+        self._handle = None
+
+    def recent(self, region: str = None) -> List[Sample]:
+        """Return the samples in the history, oldest first, optionally only those from `region`."""
+        return [s for s in list(self.history) if region is None or s.region == region]
@@ -0,0 +1,142 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+
+class Task:
+    """A function run periodically by a `Scheduler`."""
+    __slots__ = ('function', 'period', 'name', 'deadline', 'cancelled', 'runs', 'missed')
+
+    def __init__(self, function: Callable[[], None], period: float, name: str):
+        self.function = function
+        self.period = period
+        self.name = name
+        self.deadline = 0.0  # the time (on the monotonic clock) at which this task is next due to run
+        self.cancelled = False
+        self.runs = 0  # the number of times this task has been run
+        self.missed = 0  # the number of deadlines that passed while this task or another was running, and were skipped
+
+    def __repr__(self):
+        return f'Task({self.name!r}, period={self.period}, runs={self.runs}, missed={self.missed})'
+
+
+class Scheduler:
+    """Runs periodic tasks on a single persistent thread.
+
+    Tasks are kept in a heap ordered by their next deadline. A task's deadlines are fixed multiples of its period from
+    when it was first scheduled, so its cadence is steady however long each run takes. If a run overruns one or more
+    deadlines, they are skipped rather than run in a burst, and counted in the task's `missed` attribute.
+
+    Like `threading.Timer`, the thread is not a daemon; it exits once no tasks remain."""
+
+    def __init__(self, name='flair scheduler'):
+        self.name = name
+        self._heap: List[Tuple[float, int, Task]] = []
+        self._sequence = itertools.count()  # breaks ties between tasks with the same deadline
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        # if set, called after each run of a task with the task, how late (in seconds) the run started, how long it
+        # took and the number of deadlines it caused to be skipped. Used by `metrics`
+        self.observer: Optional[Callable[[Task, float, float, int], None]] = None
+
+    @property
+    def tasks(self) -> List[Task]:
+        """The tasks currently scheduled, in no particular order."""
+        with self._condition:
+            return [t for d, _, t in self._heap if not t.cancelled and d == t.deadline]
+
+    def schedule(self, function: Callable[[], None], period: float, name: str = None, delay=0.0) -> Task:
+        """Run `function` every `period` seconds, beginning after `delay` seconds. Returns a `Task` which can be passed
+        to `cancel`."""
+        if period <= 0:
+            raise ValueError('Period must be positive')
+        task = Task(function, period, name or function.__name__)
+        task.deadline = time.monotonic() + delay
+        with self._condition:
+            self._push(task)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.start()
+            self._condition.notify()
+        return task
+
+    def reschedule(self, task: Task, period: float):
+        """Change the period of a task. If the period is shortened, the task is run immediately so that the higher rate
+        takes effect without waiting out the old period."""
+        if period <= 0:
+            raise ValueError('Period must be positive')
+        with self._condition:
+            if period < task.period and not task.cancelled:
+                task.deadline = time.monotonic()
+                self._push(task)  # any existing entry for this task is now stale and will be discarded
+                self._condition.notify()
+            task.period = period
+
+    def cancel(self, task: Task):
+        """Stop running a task. If it is currently running, it will finish."""
+        with self._condition:
+            task.cancelled = True
+            self._condition.notify()
+
+    def _push(self, task: Task):
+        """Add a task to the heap. Must be called with the condition held."""
+        heapq.heappush(self._heap, (task.deadline, next(self._sequence), task))
+
+    def _next_due(self) -> Optional[Task]:
+        """Wait until the next task is due and remove it from the heap, or return None if no tasks remain."""
+        with self._condition:
+            while True:
+                while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] != self._heap[0][2].deadline):
+                    heapq.heappop(self._heap)  # discard tasks that have been cancelled or rescheduled
+                if not self._heap:
+                    self._thread = None
+                    return None
+                deadline, _, task = self._heap[0]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    heapq.heappop(self._heap)
+                    return task
+                self._condition.wait(remaining)
+
+    def _run(self):
+        """Run tasks as they become due for as long as any remain."""
+        while True:
+            task = self._next_due()
+            if task is None:
+                return
+
+            started = time.monotonic()
+            try:
+                task.function()
+            except Exception:
+                traceback.print_exc()  # one failing task must not stop the others
+            task.runs += 1
+
+            deadline = task.deadline + task.period
+            now = time.monotonic()
+            skipped = 0
+            if deadline <= now:  # overran; skip to the next deadline still in the future
+                skipped = int((now - deadline) // task.period) + 1
+                task.missed += skipped
+                deadline += skipped * task.period
+            observer = self.observer
+            if observer is not None:
+                observer(task, started - task.deadline, now - started, skipped)
+            task.deadline = deadline
+
+            with self._condition:
+                if not task.cancelled:
+                    self._push(task)
+
+
+scheduler = Scheduler()  # shared by all FreelancerState instances
@@ -5,25 +5,39 @@
  License, v. 2.0. If a copy of the MPL was not distributed with this
  file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
+import asyncio
+from contextlib import contextmanager
 import threading
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
 
 import flint as fl
 from flint.maps import PosVector
 
 from ..inspect import events
+from ..inspect.scheduler import scheduler, Task
+from ..inspect.policy import PollingPolicy
+from ..inspect.universe import get_universe
 from ..hook import window, process, storage
+from ..hook.watch import MemoryWatcher
+from ..hook import input as _input  # noqa: F401 - input emits the chat box events, so must be initialised
 
 
 class state_variable:
-    def __init__(self, initially, passive=False):
+    def __init__(self, initially, passive=False, period=None):
         """Handle arguments to decorator.
         `initially`: the initial value of this variable
         `passive`: if true, signifies that the getter does not compute the value of the variable - i.e. it is set
-        elsewhere."""
+        elsewhere.
+        `period`: how often (in seconds) this variable should be polled. If None, the period passed to `begin_polling`
+        is used."""
         self.default = initially
-        self.last = initially
         self.passive = passive
+        self.period = period
+        self.name = None  # set by __set_name__
+
+    def __set_name__(self, owner, name):
+        """Handle the descriptor being assigned to a class attribute."""
+        self.name = name
 
     def __call__(self, getter):
         """Handle first function passed to decorator."""
@@ -33,19 +47,31 @@ class state_variable:
         return self
 
     def __get__(self, instance, owner):
-        """Return the current value of the state variable. If the game is not running, this is the default value."""
-        if not window.is_present():
+        """Return the current value of the state variable. If the game is not running, this is the default value. While
+        a snapshot of memory is being read the game is known to be running, so its presence is not checked again.
+        Accessed on the class, returns the descriptor itself."""
+        if instance is None:
+            return self
+        if instance._snapshot is None and not window.is_present(instance.pid):
             return self.default
         else:
             if self.passive:
-                return self.last
+                return self.last(instance)
             return self.fget(instance)
 
     def __set__(self, instance, value):
-        """Handle state variable being updated."""
-        if value != self.last:
-            self.fchanged(instance, value, self.last)
-            self.last = value
+        """Handle state variable being updated. The new value is stored before the change handler is called, so that
+        anything the handler calls sees it."""
+        last = self.last(instance)
+        if value != last:
+            instance._values[self.name] = value
+            self.fchanged(instance, value, last)
+            instance._notify_watchers(self.name, value)
+
+    def last(self, instance) -> Any:
+        """Return the last value this variable was set to for `instance`. Values are stored per instance, so that
+        several `FreelancerState`s can exist at once."""
+        return instance._values.get(self.name, self.default)
 
     def changed(self, fchanged):
         """Handle second function passed to decorator."""
@@ -55,92 +81,314 @@ class state_variable:
         return self
 
 
+class State(NamedTuple):
+    """An immutable snapshot of the game's state, taken at a single instant. See `FreelancerState` for the meaning of
+    each field. `account` is not included as it is read from the registry rather than the game's memory."""
+    running: bool
+    foreground: bool
+    chat_box: bool
+    character_loaded: bool
+    name: Optional[str]
+    credits: Optional[int]
+    system: Optional[str]
+    base: Optional[str]
+    docked: Optional[bool]
+    pos: Optional[PosVector]
+    mouseover: str
+
+
+def diff(prev: State, cur: State) -> Dict[str, Any]:
+    """Compare two snapshots, returning a dict mapping the name of each field that has changed to its new value."""
+    return {field: new for field, old, new in zip(State._fields, prev, cur) if new != old}
+
+
 class FreelancerState:
     """An object which holds the state of the game and emits most of flair's events when it detects that a variable has
     changed."""
-    def __init__(self, freelancer_root):
+    # the variables refreshed by polling, in the order they are refreshed. Remember to add new properties here or they
+    # will not be polled. `running` is always refreshed first, as every other variable depends on it
+    POLLED = ('foreground', 'character_loaded', 'name', 'credits', 'pos', 'docked', 'mouseover', 'chat_box')
+
+    def __init__(self, freelancer_root, pid: int = None):
+        """`freelancer_root`: the path to the Freelancer installation directory.
+        `pid`: if given, the pid of the instance of the game to hook. Otherwise, whichever instance is found is used."""
+        self.pid = pid
+        self.events = events.Namespace()  # signals for this instance alone, which also emit those in `flair.events`
+        self._values: Dict[str, Any] = {}  # the last value of each state variable
+        self._watchers: Dict[str, List[Callable[[Any], None]]] = {}  # called once when a variable next changes
+        self._watchers_lock = threading.Lock()
+        self._refresh_listeners: Tuple[Callable[[State], None], ...] = ()  # called with each state refreshed by polling
         fl.paths.set_install_path(freelancer_root)
-        self._systems = {s.name() for s in fl.get_systems() if s.name()}
-        self._bases = {b.name() for b in fl.get_bases() if b.name()}
-        self._timer = None
+        self.universe = get_universe(freelancer_root)  # loaded in the background
+        # each polling task, its period, its variables and whether the polling policy applies to it
+        self._polls: List[Tuple[Task, float, FrozenSet[str], bool]] = []
+        self.policy = PollingPolicy()
         self._process = 0
+        self._exited = 0  # the handle of a process whose exit has been pushed, while its window may still be seen
+        self._lock = threading.RLock()  # serialises refreshes with exits being pushed
+        self._reads = threading.local()  # holds the memory snapshot being read from by the current thread, if any
+        self._watcher = MemoryWatcher(pid=pid)  # reads memory at high frequency while a thread is in `wait_for`
+        window.add_foreground_listener(self._foreground_changed, pid)
+        process.add_exit_listener(self._process_exited, pid)
         self.begin_polling()
 
+    def close(self):
+        """Stop polling and remove the listeners this object has registered, so that it can be garbage collected. Call
+        this once the instance of the game it is bound to has exited, or the object is no longer needed."""
+        self.end_polling()
+        window.remove_foreground_listener(self._foreground_changed, self.pid)
+        process.remove_exit_listener(self._process_exited, self.pid)
+
     def __str__(self):
-        return (f'State(running={self.running}, '
-                f'foreground={self.foreground}, '
-                f'chat_box={self.chat_box}, '
-                f'char_loaded={self.character_loaded}, '
-                f'character_name={self.name!r}, '
-                f'system={self.system!r}, '
-                f'base={self.base!r}, '
-                f'docked={self.docked!r}, '
-                f'credits={self.credits}, '
-                f'pos={self.pos!r})')
-
-    def refresh(self):
-        """Cause state variables to refresh themselves."""
-        self.running = self.running
-        self.foreground = self.foreground
-
-        if self.running:  # remember to add new properties here or they will not be polled
-            self.character_loaded = self.character_loaded
-            self.name = self.name
-            self.credits = self.credits
-            self.pos = self.pos
-            self.docked = self.docked
-            self.mouseover = self.mouseover
-            self.chat_box = self.chat_box
-
-    def begin_polling(self, period=1.0, print_state=False):
+        return str(self.snapshot())
+
+    def refresh(self, variables: Iterable[str] = None) -> State:
+        """Cause state variables to refresh themselves. If `variables` is given, only the named variables are
+        refreshed (in addition to `running`). Returns a snapshot of the refreshed state."""
+        with self._lock:
+            self.running = running = self._is_running()
+            if not running:
+                self.foreground = False
+                return self._default_state()
+
+            variables = self.POLLED if variables is None else set(variables)
+            with self._consistent_read():
+                for name in self.POLLED:
+                    if name in variables:
+                        setattr(self, name, getattr(self, name))
+                return self._capture()
+
+    def _is_running(self) -> bool:
+        """Whether the game is running. The window of a process whose exit has already been pushed can outlive it
+        briefly, so while it is still seen the process is checked too."""
+        present = window.is_present(self.pid)
+        if present and self._exited:
+            if process.get_process(self.pid) in (0, self._exited):
+                return False
+            self._exited = 0  # a new instance of the game has been started
+        elif not present:
+            self._exited = 0
+        return present
+
+    def snapshot(self) -> State:
+        """Return an immutable snapshot of the game's state. Unlike accessing each property in turn, this reads the
+        game's memory only once, so every field comes from the same instant."""
+        if not window.is_present(self.pid):
+            return self._default_state()
+        with self._consistent_read():
+            return self._capture()
+
+    @property
+    def _snapshot(self) -> Optional[process.Snapshot]:
+        """The snapshot of memory the current thread is reading state variables from, if any."""
+        return getattr(self._reads, 'snapshot', None)
+
+    @property
+    def _memory(self):
+        """The source state variables should read memory from: the snapshot being read from by the current thread if
+        there is one, otherwise the process itself."""
+        snapshot = self._snapshot
+        return self._process if snapshot is None else snapshot
+
+    def wait_for(self, predicate: Callable[[State], bool], timeout: Optional[float] = None) -> bool:
+        """Block until `predicate`, called with a snapshot of the game's state, returns true, or `timeout` seconds pass,
+        e.g. `flair.state.wait_for(lambda s: s.chat_box, timeout=0.1)`. Returns whether the predicate became true.
+
+        While a thread is waiting, the game's memory is read every few milliseconds and the thread is woken after each
+        read, so a change is noticed within a frame or so of happening without busy-waiting."""
+        def satisfied(memory: process.Snapshot) -> bool:
+            if not window.is_present(self.pid):
+                return predicate(self._default_state())
+            with self._consistent_read(memory):
+                return predicate(self._capture())
+
+        return self._watcher.wait_until(satisfied, timeout)
+
+    async def changed(self, variable: str, timeout: float = None) -> Any:
+        """Wait until the state variable named `variable` next changes, returning its new value. Raises
+        `asyncio.TimeoutError` if it does not change within `timeout` seconds."""
+        if not isinstance(vars(FreelancerState).get(variable), state_variable):
+            raise AttributeError(f'No such state variable: {variable!r}')
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def resolve(value):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(value))
+
+        self._add_watcher(variable, resolve)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._remove_watcher(variable, resolve)
+
+    async def poll(self, period=1.0) -> AsyncIterator[State]:
+        """Asynchronously yield the state refreshed by polling at most every `period` seconds, e.g.
+        `async for state in flair.state.poll(): ...`. Snapshots are taken from the refreshes already made by the
+        scheduler thread (see `begin_polling`), so the game is not read again and no change is emitted twice; if
+        several refreshes are made within `period`, only the latest is yielded. Nothing is yielded while polling is
+        stopped."""
+        loop = asyncio.get_event_loop()
+        latest: List[State] = []
+        refreshed = asyncio.Event()
+
+        def deliver(state: State):
+            latest[:] = [state]
+            refreshed.set()
+
+        def listener(state: State):
+            loop.call_soon_threadsafe(deliver, state)
+
+        with self._watchers_lock:
+            self._refresh_listeners += (listener,)
+        try:
+            while True:
+                await refreshed.wait()
+                refreshed.clear()
+                yielded = loop.time()
+                yield latest[0]
+                await asyncio.sleep(max(0.0, period - (loop.time() - yielded)))
+        finally:
+            with self._watchers_lock:
+                self._refresh_listeners = tuple(f for f in self._refresh_listeners if f is not listener)
+
+    def _add_watcher(self, variable: str, function: Callable[[Any], None]):
+        """Call `function` with the new value of a state variable the next time it changes."""
+        with self._watchers_lock:
+            self._watchers.setdefault(variable, []).append(function)
+
+    def _remove_watcher(self, variable: str, function: Callable[[Any], None]):
+        """Remove a watcher added with `_add_watcher`, if it has not already been called."""
+        with self._watchers_lock:
+            if function in self._watchers.get(variable, ()):
+                self._watchers[variable].remove(function)
+
+    def _notify_watchers(self, variable: str, value: Any):
+        """Call and remove the watchers of a state variable that has just changed."""
+        with self._watchers_lock:
+            watchers = self._watchers.pop(variable, ())
+        for watcher in watchers:
+            watcher(value)
+
+    def _foreground_changed(self, foreground: bool):
+        """Handle a change in whether the game is in the foreground being pushed by the window hook. This is called on
+        the hook's thread, so is serialised with refreshes, which also set `foreground`, to emit each change once."""
+        with self._lock:
+            self.foreground = foreground
+            if self._polls:
+                self._apply_policy(self.snapshot())
+
+    def _process_exited(self):
+        """Handle the game's process exiting being pushed by the process hook."""
+        with self._lock:
+            self._exited = self._process
+            self.running = False
+
+    @contextmanager
+    def _consistent_read(self, snapshot: process.Snapshot = None):
+        """Within this context, state variables are read from a single snapshot of the game's memory, taken upon
+        entry unless `snapshot` is given. The game must be running."""
+        self._reads.snapshot = snapshot if snapshot is not None else process.read_snapshot(self._process)
+        try:
+            yield
+        finally:
+            self._reads.snapshot = None
+
+    def _capture(self) -> State:
+        """Capture the current value of every state variable into a `State`. Must be called in `_consistent_read`."""
+        return State(running=True, **{f: getattr(self, f) for f in State._fields if f != 'running'})
+
+    @staticmethod
+    def _default_state() -> State:
+        """Return the state of the game when it is not running."""
+        return State(**{f: vars(FreelancerState)[f].default for f in State._fields})
+
+    def begin_polling(self, period=1.0, print_state=False, periods: Dict[str, float] = None,
+                      policy: PollingPolicy = None):
         """Begin polling the game's state and emitting events. Called upon instantiation by default. If `print_state`
-        is true, the instance's repr will be printed on each refresh."""
-        def poll():
-            self.refresh()
-            if print_state:
-                print(self)
-            self._timer = threading.Timer(period, poll)
-            self._timer.start()
+        is true, the instance's repr will be printed on each refresh.
+
+        Each variable is polled at the period given to its decorator, or `period` if none was. `periods` may be used to
+        override this for individual variables, e.g. `{'pos': 0.05}`. All polling is run by a single shared scheduler
+        thread, with variables sharing a period being refreshed together.
 
+        `policy` adjusts these periods according to the game's state after each refresh; see `flair.inspect.policy`.
+        By default, the periods are always used as given."""
         self.end_polling()
-        poll()
+        self.policy = policy or PollingPolicy()
+        periods = periods or {}
+
+        # maps each period, and whether the policy is to be applied to it, to the variables to be polled at it
+        groups = {(period, True): set()}
+        for name in self.POLLED:
+            variable_period = periods.get(name, vars(FreelancerState)[name].period or period)
+            groups.setdefault((variable_period, name not in self.policy.full_rate), set()).add(name)
+
+        for (group_period, adaptive), variables in groups.items():
+            def poll(variables=frozenset(variables), print_state=print_state and adaptive and group_period == period):
+                state = self.refresh(variables)
+                if print_state:
+                    print(state)
+                for listener in self._refresh_listeners:
+                    listener(state)
+                self._apply_policy(state)
+            name = f'refresh every {group_period}s' + ('' if adaptive else ' (full rate)')
+            task = scheduler.schedule(poll, group_period, name=name)
+            self._polls.append((task, group_period, frozenset(variables), adaptive))
 
     def end_polling(self):
         """Stop polling the game's state and emitting events."""
-        if self._timer:
-            self._timer.cancel()
+        for task, *_ in self._polls:
+            scheduler.cancel(task)
+        self._polls.clear()
+
+    @property
+    def polling_periods(self) -> Dict[str, float]:
+        """The period (in seconds) at which each polled variable is currently being polled, after the polling policy
+        has been applied."""
+        return {name: task.period for task, _, variables, _ in self._polls for name in variables}
+
+    def _apply_policy(self, state: State):
+        """Adjust the period of each polling task according to the polling policy and the game's current state. Tasks
+        polling variables in the policy's `full_rate` are left alone."""
+        for task, period, _, adaptive in list(self._polls):
+            if not adaptive:
+                continue
+            effective = self.policy.period(state, period)
+            if effective != task.period:
+                scheduler.reschedule(task, effective)
 
     @state_variable(initially=False)
     def running(self) -> bool:
         """Whether an instance of the game is running."""
-        return window.is_present()
+        return window.is_present(self.pid)
 
     @running.changed
     def running(self, new, last):
         if new:  # Freelancer has been started
-            self._process = process.get_process()
-            events.freelancer_started.emit()
+            self._process = process.get_process(self.pid)
+            self.events.freelancer_started.emit()
         else:  # Freelancer has been stopped
             if self._process and type(self._process) is not int:
                 self._process.close()
-            events.freelancer_stopped.emit()
+            self._process = 0
+            self.events.freelancer_stopped.emit()
 
     @state_variable(initially=False)
     def foreground(self) -> bool:
         """Whether an instance of the game is in the foreground and accepting input."""
-        return window.is_foreground() if self.running else False
+        return window.is_foreground(self.pid)  # if not running, the default is returned without calling this
 
     @foreground.changed
     def foreground(self, new, last):
         if new:
-            events.switched_to_foreground.emit()
+            self.events.switched_to_foreground.emit()
         else:
-            events.switched_to_background.emit()
+            self.events.switched_to_background.emit()
 
     @state_variable(initially=False)
     def chat_box(self) -> bool:
         """Whether the chat box is open."""
-        return process.get_chat_box_state(self._process)
+        return process.get_chat_box_state(self._memory)
 
     @chat_box.changed
     def chat_box(self, new, last):
@@ -153,23 +401,27 @@ class FreelancerState:
 
     @account.changed
     def account(self, new, last):
-        events.account_changed.emit(account=new)
+        self.events.account_changed.emit(account=new)
 
     @state_variable(initially='')
     def mouseover(self) -> str:
         """See documentation in hook/process."""
-        return process.get_mouseover(self._process)
+        return process.get_mouseover(self._memory)
 
     @mouseover.changed
     def mouseover(self, new, last):
-        if new in self._systems:
+        self.universe.when_loaded(lambda: self._mouseover_changed(new))
+
+    def _mouseover_changed(self, mouseover: str):
+        """Handle a change in the mouseover text, once the universe's static data is available to interpret it."""
+        if mouseover in self.universe.systems:
             # player has entered a new system
-            self.system = new
+            self.system = mouseover
 
     @state_variable(initially=False)
     def character_loaded(self) -> bool:
         """Whether a character is currently loaded (i.e. the player is logged in), either in SP or MP."""
-        return process.get_character_loaded(self._process)
+        return process.get_character_loaded(self._memory)
 
     @character_loaded.changed
     def character_loaded(self, new, last):
@@ -183,20 +435,20 @@ class FreelancerState:
     @state_variable(initially=None)
     def name(self) -> Optional[str]:
         """The name of the currently active character if there is one, otherwise None."""
-        return process.get_name(self._process) if self.character_loaded else None
+        return process.get_name(self._memory) if self.character_loaded else None
 
     @name.changed
     def name(self, new, last):
-        events.character_changed.emit(name=new)
+        self.events.character_changed.emit(name=new)
 
     @state_variable(initially=None)
     def credits(self) -> Optional[int]:
         """The number of credits the active character has if there is one, otherwise None."""
-        return process.get_credits(self._process) if self.character_loaded else None
+        return process.get_credits(self._memory) if self.character_loaded else None
 
     @credits.changed
     def credits(self, new, last):
-        events.credits_changed.emit(balance=new)
+        self.events.credits_changed.emit(balance=new)
 
     @state_variable(initially=None, passive=True)
     def system(self) -> Optional[str]:
@@ -206,7 +458,7 @@ class FreelancerState:
 
     @system.changed
     def system(self, new, last):
-        events.system_changed.emit(system=new)
+        self.events.system_changed.emit(system=new)
 
     @state_variable(initially=None, passive=True)
     def base(self) -> Optional[str]:
@@ -217,17 +469,24 @@ class FreelancerState:
     @state_variable(initially=None)
     def docked(self) -> Optional[bool]:
         """Whether the active character is presently docked at a base if there is one, otherwise None."""
-        return process.get_docked(self._process) if self.character_loaded else None
+        return process.get_docked(self._memory) if self.character_loaded else None
 
     @docked.changed
     def docked(self, new, last):
-        if new and self.mouseover in self._bases:  # todo: try wait_until(self.mouseover)
-            self.base = self.mouseover
-            events.docked.emit(base=self.base)
-        elif not new:
-            events.undocked.emit()
+        if new:
+            mouseover = self.mouseover  # todo: try wait_until(self.mouseover)
+            self.universe.when_loaded(lambda: self._docked_at(mouseover))
+        else:
+            self.events.undocked.emit()
+
+    def _docked_at(self, mouseover: str):
+        """Handle the player docking, once the universe's static data is available to identify the base. If they have
+        undocked again in the meantime, the event is not emitted."""
+        if mouseover in self.universe.bases and vars(FreelancerState)['docked'].last(self):
+            self.base = mouseover
+            self.events.docked.emit(base=self.base)
 
     @state_variable(initially=None)
     def pos(self) -> Optional[PosVector]:
         """The position vector of the active character if there is one, otherwise None."""
-        return PosVector(*process.get_position(self._process)) if self.character_loaded else None
+        return PosVector(*process.get_position(self._memory)) if self.character_loaded else None
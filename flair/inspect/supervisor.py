@@ -0,0 +1,55 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+import threading
+from typing import Dict
+
+from ..hook import process
+from .scheduler import scheduler
+from .state import FreelancerState
+
+
+class Supervisor:
+    """Hooks every running instance of the game at once.
+
+    Running instances are discovered periodically, and a `FreelancerState` bound to each one's pid is created for it
+    and discarded once it exits. All instances are polled by the same shared scheduler thread. Note that events are
+    still emitted through the signals in `flair.events`, whichever instance they concern, and that input hooks act
+    on whichever instance is in the foreground. To tell instances apart, connect to the signals of each state's own
+    `events` namespace instead."""
+
+    def __init__(self, freelancer_root: str, period=1.0, **polling):
+        """`freelancer_root`: the path to the Freelancer installation directory shared by every instance.
+        `period`: how often (in seconds) to look for instances that have been started or stopped.
+        `polling`: keyword arguments passed to `FreelancerState.begin_polling` for each instance."""
+        self.freelancer_root = freelancer_root
+        self.polling = polling
+        self.instances: Dict[int, FreelancerState] = {}  # maps pid to state
+        self._lock = threading.Lock()
+        self._task = scheduler.schedule(self.discover, period, name='discover instances')
+
+    def discover(self):
+        """Begin hooking any newly started instances of the game, and stop hooking those that have exited."""
+        running = set(process.get_processes())
+        with self._lock:
+            for pid in running - set(self.instances):
+                state = FreelancerState(self.freelancer_root, pid=pid)
+                if self.polling:
+                    state.begin_polling(**self.polling)
+                self.instances[pid] = state
+            for pid in set(self.instances) - running:
+                state = self.instances.pop(pid)
+                state.refresh()  # so that the instance notices it has stopped
+                state.close()
+
+    def stop(self):
+        """Stop discovering instances and polling those already hooked."""
+        scheduler.cancel(self._task)
+        with self._lock:
+            for state in self.instances.values():
+                state.close()
+            self.instances.clear()
@@ -0,0 +1,159 @@
+"""
+ Copyright (C) 2016, 2017, 2020 biqqles.
+
+ This Source Code Form is subject to the terms of the Mozilla Public
+ License, v. 2.0. If a copy of the MPL was not distributed with this
+ file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+import hashlib
+import marshal
+import os
+import threading
+import traceback
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import flint as fl
+from flint.maps import PosVector
+from flint.paths import construct_path
+
+from .. import platforms
+
+CACHE_VERSION = 1  # increment when the format of the cached data changes
+FINGERPRINTED_DIRS = ('EXE', 'DATA/UNIVERSE')  # the directories containing the files static data is read from
+
+
+class Universe:
+    """The static data about the game's universe that flair needs, i.e. system and base display names, system
+    navmap scales and solar positions.
+
+    Parsing this with flint is slow, so the result is cached on disk in marshal format, keyed by a fingerprint of the
+    game's files. Loading happens in a background thread, so that polling can begin immediately. Membership tests on
+    `systems` and `bases` do not wait for loading to finish (and so will fail until it has), while other lookups do.
+    Use `when_loaded` to defer work depending on them."""
+
+    def __init__(self, freelancer_root: str):
+        """`freelancer_root`: the path to the Freelancer installation directory. flint's install path must already
+        have been set to this."""
+        self.freelancer_root = freelancer_root
+        self.systems: FrozenSet[str] = frozenset()
+        self.bases: FrozenSet[str] = frozenset()
+        self._navmap_scales: Dict[str, float] = {}
+        self._solars: Dict[str, Tuple[Tuple[str, Tuple[float, float, float]], ...]] = {}
+        self._loaded = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []  # to be called once loaded
+        self._callbacks_lock = threading.Lock()
+        threading.Thread(target=self._load, name='flair universe loader', daemon=True).start()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until static data has been loaded, or `timeout` seconds have passed. Return whether it was loaded."""
+        return self._loaded.wait(timeout)
+
+    def when_loaded(self, function: Callable[[], None]):
+        """Call `function` once static data has been loaded: immediately if it already has been, otherwise on the
+        loader thread when it is. Functions deferred are called in the order they were passed."""
+        with self._callbacks_lock:
+            if not self._loaded.is_set():
+                self._callbacks.append(function)
+                return
+        function()
+
+    def navmap_scale(self, system: str) -> float:
+        """Return the navmap scale of the system with the given display name."""
+        self.wait()
+        return self._navmap_scales[system]
+
+    def solars(self, system: str) -> Tuple[Tuple[str, PosVector], ...]:
+        """Return the display name and position of each named solar in the system with the given display name."""
+        self.wait()
+        return tuple((name, PosVector(*pos)) for name, pos in self._solars[system])
+
+    def _load(self):
+        """Load static data from the cache if it is up to date, otherwise from flint, updating the cache."""
+        try:
+            key = fingerprint(self.freelancer_root)
+            data = read_cache(self.freelancer_root, key)
+            if data is None:
+                data = extract()
+                write_cache(self.freelancer_root, key, data)
+            self.systems = frozenset(data['navmap_scales'])
+            self.bases = frozenset(data['bases'])
+            self._navmap_scales = data['navmap_scales']
+            self._solars = data['solars']
+        finally:
+            with self._callbacks_lock:
+                self._loaded.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for function in callbacks:
+                try:
+                    function()
+                except Exception:
+                    traceback.print_exc()  # one failing callback must not stop the rest being called
+
+
+_universes: Dict[str, Universe] = {}
+_universes_lock = threading.Lock()
+
+
+def get_universe(freelancer_root: str) -> Universe:
+    """Return the `Universe` for an installation, beginning to load it if this is the first request for it."""
+    with _universes_lock:
+        if freelancer_root not in _universes:
+            _universes[freelancer_root] = Universe(freelancer_root)
+        return _universes[freelancer_root]
+
+
+def extract() -> dict:
+    """Extract the static data flair needs from the game's files using flint. This is slow."""
+    navmap_scales = {}
+    solars = {}
+    for system in fl.get_systems():
+        name = system.name()
+        if not name:
+            continue
+        navmap_scales[name] = float(system.navmapscale)
+        solars[name] = tuple((solar.name(), tuple(map(float, solar.pos))) for solar in system.contents()
+                             if solar.name())
+    bases = tuple(b.name() for b in fl.get_bases() if b.name())
+    return {'navmap_scales': navmap_scales, 'solars': solars, 'bases': bases}
+
+
+def fingerprint(freelancer_root: str) -> str:
+    """Compute a key identifying the installation and the state of the files static data is read from: the path, size
+    and modification time of every file in `FINGERPRINTED_DIRS`."""
+    digest = hashlib.sha1(f'{CACHE_VERSION}:{marshal.version}:{os.path.abspath(freelancer_root)}'.encode())
+    for directory in FINGERPRINTED_DIRS:
+        for dirpath, dirnames, filenames in os.walk(construct_path(directory)):
+            dirnames.sort()  # walk in a stable order
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def cache_path(freelancer_root: str) -> str:
+    """Return the path to the cache file for an installation."""
+    install = hashlib.sha1(os.path.abspath(freelancer_root).encode()).hexdigest()[:16]
+    return os.path.join(platforms.CACHE_DIR, f'universe-{install}.marshal')
+
+
+def read_cache(freelancer_root: str, key: str) -> Optional[dict]:
+    """Read cached static data for an installation, returning None if there is none or it is stale."""
+    try:
+        with open(cache_path(freelancer_root), 'rb') as f:
+            cached_key, data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return data if cached_key == key else None
+
+
+def write_cache(freelancer_root: str, key: str, data: dict):
+    """Write static data for an installation to the cache. Failure to do so is not an error."""
+    path = cache_path(freelancer_root)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            marshal.dump((key, data), f)
+        os.replace(path + '.tmp', path)  # atomically, so a partially written cache is never read
+    except OSError:
+        pass
@@ -18,9 +18,11 @@ if WIN32:
     os.system('color')  # enable ANSI colour codes on Windows
 
     HOME = os.path.expanduser('~')
+    CACHE_DIR = os.path.join(os.environ.get('LOCALAPPDATA', HOME), 'flair')
 
 elif LINUX:
     if os.geteuid() != 0:
         raise ImportError('You must be superuser to use this library on Linux')
 
     HOME = os.path.expanduser(f'~{os.environ["SUDO_USER"]}')
+    CACHE_DIR = os.path.join(HOME, '.cache', 'flair')
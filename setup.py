@@ -33,4 +33,5 @@ setup(
 
     python_requires='>=3.6',
     install_requires=open('requirements.txt').readlines(),
+    extras_require={'scan': ['numpy']},  # for flair.hook.process.scan
 )